@@ -0,0 +1,297 @@
+"""Load generator for the message board.
+
+Simulates ROOMS x CLIENTS browser tabs against a local instance: every
+client polls /messages?since= like the page does, and now and then sends
+a message or updates its profile. Reports throughput, p50/p99 latency per
+operation and server RSS, and can save the results as JSON so runs can
+be compared.
+
+    python bench.py --spawn server --rooms 10 --clients 5 --duration 20
+    python bench.py --url http://localhost:5000 --pid 1234 --output run.json
+    python bench.py --spawn server --output new.json --compare old.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def read_rss_kb(pid):
+    """Resident set size of a process in KB (Linux only, None elsewhere)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class Connection:
+    """A keep-alive HTTP connection that reconnects once if the server closed it"""
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.conn = None
+
+    def request(self, method, path, body=None):
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        payload = json.dumps(body) if body is not None else None
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                self.conn.request(method, path, payload, headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                return response.status, data
+            except (http.client.HTTPException, ConnectionError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+
+class Stats:
+    """Latencies (seconds) and error counts per operation, shared by all clients"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, op, elapsed, ok):
+        with self.lock:
+            self.latencies.setdefault(op, []).append(elapsed)
+            if not ok:
+                self.errors[op] = self.errors.get(op, 0) + 1
+
+
+def run_client(url, room, stats, stop, args):
+    """One simulated tab: poll, and sometimes send or update the profile"""
+    conn = Connection(url)
+    user_id = 'bench-' + uuid.uuid4().hex[:8]
+    cursor = None
+    rng = random.Random()
+    room_q = urllib.parse.quote(room)
+
+    while not stop.is_set():
+        roll = rng.random()
+        start = time.perf_counter()
+        try:
+            if roll < args.send_ratio:
+                op = 'send'
+                status, data = conn.request('POST', '/send', {
+                    'room': room,
+                    'text': 'bench message ' + uuid.uuid4().hex[:rng.randint(4, 32)],
+                    'sender_id': user_id,
+                    'since': cursor,
+                })
+                new = json.loads(data).get('messages', []) if status == 200 else []
+            elif roll < args.send_ratio + args.profile_ratio:
+                op = 'user'
+                status, data = conn.request('POST', '/user', {
+                    'user_id': user_id,
+                    'name': 'Bench' + str(rng.randint(0, 999)),
+                })
+                new = []
+            else:
+                op = 'poll'
+                path = (f'/messages?room={room_q}&user={user_id}'
+                        f'&since={urllib.parse.quote(cursor or "")}')
+                status, data = conn.request('GET', path)
+                new = json.loads(data) if status == 200 else []
+            ok = status == 200
+        except Exception:
+            ok, new = False, []
+        stats.record(op, time.perf_counter() - start, ok)
+
+        if new:
+            cursor = new[-1]['id']
+        if args.think > 0:
+            stop.wait(args.think * rng.uniform(0.5, 1.5))
+
+
+def wait_for_server(url, timeout=15):
+    """Block until the server answers, or raise after `timeout` seconds"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            status, _ = Connection(url).request('GET', '/messages?room=__bench_ping__')
+            if status == 200:
+                return
+        except Exception:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'server at {url} did not come up')
+
+
+def spawn_server(module, port, keep_limits=False):
+    """Start `module`'s Flask app on `port` without the debug reloader"""
+    code = (
+        f'import {module}; '
+        f'{module}.app.run(host="127.0.0.1", port={port}, debug=False, threaded=True)'
+    )
+    env = dict(os.environ)
+    if not keep_limits:
+        # The load is generated on purpose, so don't rate limit it
+        for name in ('MESSAGE_BOARD_SEND_LIMIT', 'MESSAGE_BOARD_ROOM_SEND_LIMIT',
+                     'MESSAGE_BOARD_POLL_LIMIT'):
+            env[name] = ''
+    return subprocess.Popen(
+        [sys.executable, '-c', code],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def summarize(stats, elapsed):
+    """Throughput and latency summary per operation and overall"""
+    ops = {}
+    total = 0
+    all_latencies = []
+    for op, values in sorted(stats.latencies.items()):
+        values = sorted(values)
+        total += len(values)
+        all_latencies.extend(values)
+        ops[op] = {
+            'requests': len(values),
+            'errors': stats.errors.get(op, 0),
+            'throughput_rps': round(len(values) / elapsed, 1),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 2),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+        }
+    all_latencies.sort()
+    ops['all'] = {
+        'requests': total,
+        'errors': sum(stats.errors.values()),
+        'throughput_rps': round(total / elapsed, 1),
+        'p50_ms': round(percentile(all_latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(all_latencies, 0.99) * 1000, 2),
+    }
+    return ops
+
+
+def print_report(result, baseline=None):
+    print(f"\n{result['rooms']} rooms x {result['clients_per_room']} clients, "
+          f"{result['duration_s']}s")
+    print(f"{'op':<6} {'reqs':>8} {'err':>5} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for op, row in result['ops'].items():
+        line = (f"{op:<6} {row['requests']:>8} {row['errors']:>5} {row['throughput_rps']:>9} "
+                f"{row['p50_ms']:>9} {row['p99_ms']:>9}")
+        old = (baseline or {}).get('ops', {}).get(op)
+        if old:
+            line += (f"   (req/s {row['throughput_rps'] - old['throughput_rps']:+.1f}, "
+                     f"p99 {row['p99_ms'] - old['p99_ms']:+.2f} ms)")
+        print(line)
+    rss = result.get('server_rss_kb')
+    if rss:
+        print(f"server RSS: start {rss['start']} KB, end {rss['end']} KB, peak {rss['peak']} KB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the message board')
+    parser.add_argument('--url', default=None, help='server to test (default: spawn one)')
+    parser.add_argument('--spawn', default='server', help='module to start when no --url is given')
+    parser.add_argument('--port', type=int, default=5055, help='port for the spawned server')
+    parser.add_argument('--pid', type=int, default=None, help='server PID for RSS when using --url')
+    parser.add_argument('--keep-limits', action='store_true',
+                        help='leave rate limiting on in the spawned server')
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--clients', type=int, default=5, help='clients per room')
+    parser.add_argument('--duration', type=float, default=15, help='seconds to run')
+    parser.add_argument('--send-ratio', type=float, default=0.05, help='fraction of requests that send')
+    parser.add_argument('--profile-ratio', type=float, default=0.005, help='fraction that hit /user')
+    parser.add_argument('--think', type=float, default=0.0,
+                        help='mean seconds between a client\'s requests (the page polls every 1s)')
+    parser.add_argument('--output', default=None, help='write results as JSON here')
+    parser.add_argument('--compare', default=None, help='previous results JSON to diff against')
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    pid = args.pid
+    if url is None:
+        server = spawn_server(args.spawn, args.port, args.keep_limits)
+        url = f'http://127.0.0.1:{args.port}'
+        pid = server.pid
+
+    try:
+        wait_for_server(url)
+        stats = Stats()
+        stop = threading.Event()
+        rss = {'start': read_rss_kb(pid) if pid else None}
+        rss['peak'] = rss['start'] or 0
+
+        threads = []
+        for r in range(args.rooms):
+            for _ in range(args.clients):
+                t = threading.Thread(target=run_client,
+                                     args=(url, f'bench-{r}', stats, stop, args), daemon=True)
+                t.start()
+                threads.append(t)
+
+        started = time.perf_counter()
+        while time.perf_counter() - started < args.duration:
+            time.sleep(0.5)
+            if pid:
+                rss['peak'] = max(rss['peak'], read_rss_kb(pid) or 0)
+        stop.set()
+        for t in threads:
+            t.join(timeout=5)
+        elapsed = time.perf_counter() - started
+        rss['end'] = read_rss_kb(pid) if pid else None
+
+        result = {
+            'timestamp': datetime.now().isoformat(),
+            'url': url,
+            'rooms': args.rooms,
+            'clients_per_room': args.clients,
+            'duration_s': round(elapsed, 2),
+            'send_ratio': args.send_ratio,
+            'think_s': args.think,
+            'ops': summarize(stats, elapsed),
+            'server_rss_kb': rss if rss['start'] is not None else None,
+        }
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f'\nResults saved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
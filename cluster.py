@@ -0,0 +1,152 @@
+"""Cluster helpers: consistent hashing of rooms onto nodes and pooled
+keep-alive connections between nodes.
+
+server.py uses these when MESSAGE_BOARD_CLUSTER lists the nodes. Run this
+file to start a local cluster for testing:
+
+    MESSAGE_BOARD_ADMIN_TOKEN=secret python cluster.py --nodes 3 --base-port 5101
+"""
+import argparse
+import bisect
+import hashlib
+import http.client
+import os
+import queue
+import subprocess
+import sys
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring: each node owns `vnodes` points on the ring and a
+    room belongs to the first point at or after the room's hash. Adding or
+    removing a node only moves the rooms next to its points."""
+
+    def __init__(self, nodes, vnodes=64):
+        self.nodes = sorted(set(nodes))
+        self.points = []
+        self.owners = []
+        ring = sorted((_hash(f'{node}#{i}'), node) for node in self.nodes for i in range(vnodes))
+        for point, node in ring:
+            self.points.append(point)
+            self.owners.append(node)
+
+    def owner(self, room):
+        if not self.points:
+            return None
+        index = bisect.bisect_left(self.points, _hash(room)) % len(self.points)
+        return self.owners[index]
+
+
+class NodeClient:
+    """HTTP client for one node, reusing keep-alive connections across threads"""
+
+    def __init__(self, url, timeout=40, pool_size=16):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.timeout = timeout
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _connection(self):
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _release(self, conn):
+        try:
+            self.pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request; returns (status, headers dict, body bytes).
+
+        A pooled connection the node has since closed is retried once on a
+        fresh one.
+        """
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body, headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                if attempt:
+                    raise
+                continue
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+            return response.status, dict(response.getheaders()), data
+
+    def stream(self, method, path, headers=None):
+        """Send a request whose response is read as it arrives, on its own
+        connection. Returns (status, headers, chunks): an iterator of body
+        chunks that closes the connection when exhausted or closed."""
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.request(method, path, None, headers or {})
+            response = conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            raise
+
+        def chunks():
+            try:
+                while True:
+                    chunk = response.read1(65536)
+                    if not chunk:
+                        return
+                    yield chunk
+            finally:
+                conn.close()
+
+        return response.status, dict(response.getheaders()), chunks()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Start a local message board cluster')
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--base-port', type=int, default=5101)
+    parser.add_argument('--module', default='server', help='server module to run on each node')
+    args = parser.parse_args()
+
+    if not os.environ.get('MESSAGE_BOARD_ADMIN_TOKEN'):
+        sys.exit('Set MESSAGE_BOARD_ADMIN_TOKEN: nodes use it to talk to each other')
+
+    urls = [f'http://127.0.0.1:{args.base_port + i}' for i in range(args.nodes)]
+    processes = []
+    for url in urls:
+        port = urllib.parse.urlsplit(url).port
+        env = dict(os.environ, MESSAGE_BOARD_NODE=url, MESSAGE_BOARD_CLUSTER=','.join(urls))
+        code = (f'import {args.module}; '
+                f'{args.module}.app.run(host="127.0.0.1", port={port}, debug=False, threaded=True)')
+        processes.append(subprocess.Popen([sys.executable, '-c', code], cwd=ROOT, env=env))
+        print(f'Node {url} (PID {processes[-1].pid})')
+
+    print('\nAny node accepts any room. Press Ctrl+C to stop the cluster.')
+    try:
+        while all(p.poll() is None for p in processes):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in processes:
+            p.terminate()
+        for p in processes:
+            p.wait(timeout=10)
+
+
+if __name__ == '__main__':
+    main()
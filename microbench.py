@@ -0,0 +1,126 @@
+"""Micro-benchmarks for the storage hot paths.
+
+Times send, get_messages (with and without `since`), update_user and
+get_user_info both at the storage layer (the helpers in server.py) and
+through the Flask test client, for rooms of 1, 200 and 10k messages and
+cursors at the head, middle, tail and missing. Shows the cost of the
+cursor lookup and the per-room trim, and catches regressions.
+
+    python microbench.py
+    python microbench.py --sizes 200 --output micro.json
+    python microbench.py --compare micro.json
+"""
+import argparse
+import json
+import sys
+import timeit
+from datetime import datetime
+
+import server
+
+SIZES = [1, 200, 10000]
+CURSORS = ['head', 'middle', 'tail', 'missing']
+
+
+def fill_room(room, size):
+    """Create `room` holding exactly `size` messages"""
+    user_data = server.get_user_info('bench-user')
+    batch = [server.build_message(f'message {i}', 'bench-user', user_data) for i in range(size)]
+    server.append_messages(room, batch)
+    return server.messages[room]
+
+
+def cursor_id(room_messages, where):
+    if where == 'head':
+        return room_messages[0]['id']
+    if where == 'middle':
+        return room_messages[len(room_messages) // 2]['id']
+    if where == 'tail':
+        return room_messages[-1]['id']
+    return 'missing-cursor'
+
+
+def time_op(fn, number):
+    """Best-of-5 time per call in microseconds"""
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def run(sizes):
+    # Let rooms grow past the usual cap so the 10k case is real
+    server.MAX_MESSAGES_PER_ROOM = max(sizes)
+    # Measure the storage paths, not the rate limiter
+    for limiter in (server.send_limiter, server.room_send_limiter, server.poll_limiter):
+        limiter.rate = 0
+    client = server.app.test_client()
+    results = {}
+
+    for size in sizes:
+        number = 200 if size < 10000 else 20
+        room = f'bench-{size}'
+        room_messages = fill_room(room, size)
+
+        # Storage layer
+        for where in CURSORS:
+            since = cursor_id(room_messages, where)
+            results[f'store.messages_since[{size},{where}]'] = time_op(
+                lambda: server.messages_since(room, since), number)
+        results[f'store.room_view_json[{size}]'] = time_op(
+            lambda: server.room_view(room, serialized=True), number)
+
+        # Through Flask
+        results[f'http.get_messages[{size},none]'] = time_op(
+            lambda: client.get(f'/messages?room={room}'), number)
+        for where in CURSORS:
+            since = cursor_id(room_messages, where)
+            results[f'http.get_messages[{size},{where}]'] = time_op(
+                lambda: client.get(f'/messages?room={room}&since={since}'), number)
+
+        # Writes last, since they grow the room
+        user_data = server.get_user_info('bench-user')
+        results[f'store.append[{size}]'] = time_op(
+            lambda: server.append_messages(room, [server.build_message('x', 'bench-user', user_data)]),
+            number)
+        results[f'http.send[{size}]'] = time_op(
+            lambda: client.post('/send', json={'room': room, 'text': 'x', 'sender_id': 'bench-user'}),
+            number)
+
+    # Profile paths don't depend on room size
+    results['store.get_user_info[existing]'] = time_op(lambda: server.get_user_info('bench-user'), 2000)
+    results['http.update_user'] = time_op(
+        lambda: client.post('/user', json={'user_id': 'bench-user', 'name': 'Bench'}), 200)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmark the message board storage paths')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        help='comma separated room sizes')
+    parser.add_argument('--output', default=None, help='write results as JSON here')
+    parser.add_argument('--compare', default=None, help='previous results JSON to diff against')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run(sizes)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    width = max(len(name) for name in results)
+    for name, us in results.items():
+        line = f'{name:<{width}}  {us:10.2f} us'
+        if name in baseline and baseline[name]:
+            line += f'  ({(us / baseline[name] - 1) * 100:+.0f}%)'
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'timestamp': datetime.now().isoformat(),
+                       'python': sys.version.split()[0],
+                       'results': results}, f, indent=2)
+        print(f'\nResults saved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""Pub/sub between message board instances.
+
+server.py publishes every room append on the channel "room:<name>" and
+subscribes only to the rooms its clients are reading. Two buses share the
+same interface (subscribe / unsubscribe / publish, with messages delivered
+to an on_message(channel, payload) callback, and a `dropped` count of
+messages that could not be published):
+
+- InProcessBus: instances in one process (tests)
+- RespBus: anything speaking the Redis protocol - Redis itself, or the
+  stand-in below:
+
+    python pubsub.py --port 6380
+"""
+import argparse
+import queue
+import socket
+import socketserver
+import threading
+import time
+import urllib.parse
+
+
+class InProcessHub:
+    """Channel -> subscribed buses, shared by every InProcessBus on it"""
+
+    def __init__(self):
+        self.channels = {}
+        self.lock = threading.Lock()
+
+
+default_hub = InProcessHub()
+
+
+class InProcessBus:
+    """Delivers published messages synchronously to buses on the same hub"""
+
+    def __init__(self, on_message, hub=None):
+        self.on_message = on_message
+        self.hub = hub or default_hub
+        self.dropped = 0
+
+    def subscribe(self, channel):
+        with self.hub.lock:
+            self.hub.channels.setdefault(channel, set()).add(self)
+
+    def unsubscribe(self, channel):
+        with self.hub.lock:
+            buses = self.hub.channels.get(channel)
+            if buses is not None:
+                buses.discard(self)
+                if not buses:
+                    del self.hub.channels[channel]
+
+    def publish(self, channel, payload):
+        with self.hub.lock:
+            buses = list(self.hub.channels.get(channel, ()))
+        for bus in buses:
+            bus.on_message(channel, payload)
+        return len(buses)
+
+
+def encode_command(*args):
+    """A command as a RESP array of bulk strings"""
+    out = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(out)
+
+
+def read_reply(f):
+    """Read one RESP value from a binary file; None on EOF"""
+    line = f.readline()
+    if not line:
+        return None
+    kind, rest = line[:1], line[1:-2]
+    if kind == b'+':
+        return rest
+    if kind == b'-':
+        raise RespError(rest.decode())
+    if kind == b':':
+        return int(rest)
+    if kind == b'$':
+        length = int(rest)
+        if length < 0:
+            return None
+        data = f.read(length + 2)
+        return data[:-2]
+    if kind == b'*':
+        return [read_reply(f) for _ in range(int(rest))]
+    raise RespError(f'Unexpected reply {line!r}')
+
+
+class RespError(Exception):
+    pass
+
+
+class RespBus:
+    """Redis-protocol pub/sub client.
+
+    Subscriptions run on one connection read by a background thread, which
+    reconnects and resubscribes if the server goes away. Publishes are
+    queued (up to `queue_size`, then dropped and counted) and sent from
+    another thread over a second connection, so a slow or unreachable
+    server never holds up the caller.
+    """
+
+    def __init__(self, url, on_message, queue_size=10000, batch_size=100):
+        parsed = urllib.parse.urlsplit(url)
+        self.address = (parsed.hostname or 'localhost', parsed.port or 6379)
+        self.on_message = on_message
+        self.channels = set()
+        self.lock = threading.Lock()
+        self.subscriber = None
+        self.publisher = None
+        self.outbox = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+        threading.Thread(target=self.listen, daemon=True).start()
+        threading.Thread(target=self.drain, daemon=True).start()
+
+    def _command(self, *args):
+        """Send a (un)subscribe command if connected; the listener replays
+        subscriptions after reconnecting, so a failure here is harmless"""
+        if self.subscriber is not None:
+            try:
+                self.subscriber.sendall(encode_command(*args))
+            except OSError:
+                pass
+
+    def subscribe(self, channel):
+        with self.lock:
+            if channel not in self.channels:
+                self.channels.add(channel)
+                self._command('SUBSCRIBE', channel)
+
+    def unsubscribe(self, channel):
+        with self.lock:
+            if channel in self.channels:
+                self.channels.discard(channel)
+                self._command('UNSUBSCRIBE', channel)
+
+    def publish(self, channel, payload):
+        """Queue a message; False if the queue was full and it was dropped"""
+        try:
+            self.outbox.put_nowait((channel, payload))
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def _send(self, batch):
+        """PUBLISH a batch in one round trip, reconnecting once if needed"""
+        data = b''.join(encode_command('PUBLISH', channel, payload) for channel, payload in batch)
+        for attempt in range(2):
+            try:
+                if self.publisher is None:
+                    sock = socket.create_connection(self.address, timeout=5)
+                    self.publisher = (sock, sock.makefile('rb'))
+                sock, f = self.publisher
+                sock.sendall(data)
+                for _ in batch:
+                    read_reply(f)
+                return
+            except (OSError, RespError):
+                if self.publisher is not None:
+                    self.publisher[0].close()
+                    self.publisher = None
+                if attempt:
+                    raise
+
+    def drain(self):
+        while True:
+            batch = [self.outbox.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.outbox.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._send(batch)
+            except (OSError, RespError):
+                with self.dropped_lock:
+                    self.dropped += len(batch)
+                time.sleep(1)
+
+    def listen(self):
+        while True:
+            try:
+                sock = socket.create_connection(self.address)
+                f = sock.makefile('rb')
+                with self.lock:
+                    self.subscriber = sock
+                    if self.channels:
+                        sock.sendall(encode_command('SUBSCRIBE', *self.channels))
+                while True:
+                    reply = read_reply(f)
+                    if reply is None:
+                        break
+                    if isinstance(reply, list) and reply[0] == b'message':
+                        self.on_message(reply[1].decode(), reply[2])
+            except (OSError, RespError):
+                pass
+            with self.lock:
+                self.subscriber = None
+            time.sleep(1)
+
+
+def connect(url, on_message):
+    """"memory" for an InProcessBus, redis://host:port for a RespBus"""
+    if url == 'memory':
+        return InProcessBus(on_message)
+    if url.startswith('redis://'):
+        return RespBus(url, on_message)
+    raise ValueError(f'Unknown pub/sub URL {url!r}')
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    """Stand-in for Redis that knows PING, SUBSCRIBE, UNSUBSCRIBE and PUBLISH"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, RespHandler)
+        self.channels = {}
+        self.lock = threading.Lock()
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+
+    def send(self, data):
+        with self.write_lock:
+            self.wfile.write(data)
+
+    def handle(self):
+        self.write_lock = threading.Lock()
+        self.subscribed = set()
+        channels = self.server.channels
+        try:
+            while True:
+                command = read_reply(self.rfile)
+                if not isinstance(command, list) or not command:
+                    break
+                name = command[0].upper()
+                if name == b'PING':
+                    self.send(b'+PONG\r\n')
+                elif name in (b'SUBSCRIBE', b'UNSUBSCRIBE'):
+                    for channel in command[1:]:
+                        with self.server.lock:
+                            if name == b'SUBSCRIBE':
+                                channels.setdefault(channel, set()).add(self)
+                                self.subscribed.add(channel)
+                            else:
+                                channels.get(channel, set()).discard(self)
+                                self.subscribed.discard(channel)
+                        self.send(b'*3\r\n' + encode_command(name.lower(), channel)[4:]
+                                  + b':%d\r\n' % len(self.subscribed))
+                elif name == b'PUBLISH' and len(command) == 3:
+                    with self.server.lock:
+                        receivers = list(channels.get(command[1], ()))
+                    message = encode_command(b'message', command[1], command[2])
+                    for receiver in receivers:
+                        try:
+                            receiver.send(message)
+                        except OSError:
+                            pass
+                    self.send(b':%d\r\n' % len(receivers))
+                else:
+                    self.send(b'-ERR unknown command\r\n')
+        except (OSError, RespError):
+            pass
+        finally:
+            with self.server.lock:
+                for channel in self.subscribed:
+                    channels.get(channel, set()).discard(self)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Minimal Redis-protocol pub/sub server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6380)
+    args = parser.parse_args()
+    with RespServer((args.host, args.port)) as server:
+        print(f'Pub/sub stand-in on redis://{args.host}:{args.port}')
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -257,18 +257,21 @@ choose_server() {
     echo "   - Transparent glass-morphism UI"
     echo "   - Same features as normal version"
     echo ""
+    echo "Either way, both looks are served: add ?theme=normal"
+    echo "or ?theme=cosmic to the link to switch."
+    echo ""
     echo "========================================"
     
     while true; do
         read -p "Enter your choice (1 or 2): " choice
         case $choice in
             1)
-                SERVER_FILE="server.py"
+                SERVER_THEME="normal"
                 SERVER_NAME="Normal Version"
                 return 0
                 ;;
             2)
-                SERVER_FILE="server_fancy.py"
+                SERVER_THEME="cosmic"
                 SERVER_NAME="Fancy Version"
                 return 0
                 ;;
@@ -281,10 +284,11 @@ choose_server() {
 
 # Function to check if server file exists
 check_server_file() {
-    if [ ! -f "$SERVER_FILE" ]; then
-        print_error "$SERVER_FILE not found!"
+    SERVER_FILE="server.py"
+    if [ ! -f "$SERVER_FILE" ] || [ ! -d "templates" ]; then
+        print_error "$SERVER_FILE or templates/ not found!"
         print_message "Make sure you're in the correct directory."
-        print_message "Expected files: server.py and server_fancy.py"
+        print_message "Expected files: server.py and templates/"
         exit 1
     fi
 }
@@ -295,8 +299,8 @@ start_server() {
     
     print_message "Starting $SERVER_NAME on port $port..."
     
-    # Start the server in background
-    python "$SERVER_FILE" &
+    # Start the server in background (the theme only sets the default page)
+    MESSAGE_BOARD_THEME="$SERVER_THEME" python "$SERVER_FILE" &
     SERVER_PID=$!
     
     # Wait for server to start
@@ -327,9 +331,20 @@ cleanup() {
     echo ""
     print_message "Shutting down..."
     
-    # Kill server if running
+    # Ask the server to stop: it finishes in-flight requests and saves its
+    # snapshot within MESSAGE_BOARD_SHUTDOWN_SECONDS, so give it that long
     if [ -n "$SERVER_PID" ] && ps -p $SERVER_PID > /dev/null 2>&1; then
-        kill $SERVER_PID 2>/dev/null
+        kill -TERM $SERVER_PID 2>/dev/null
+        local waited=0
+        local limit=$(( ${MESSAGE_BOARD_SHUTDOWN_SECONDS:-20} + 5 ))
+        while ps -p $SERVER_PID > /dev/null 2>&1 && [ $waited -lt $limit ]; do
+            sleep 1
+            waited=$((waited + 1))
+        done
+        if ps -p $SERVER_PID > /dev/null 2>&1; then
+            print_warning "Server didn't stop in ${limit}s, killing it"
+            kill -KILL $SERVER_PID 2>/dev/null
+        fi
         print_success "Server stopped"
     fi
     
@@ -1,16 +1,291 @@
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, request, jsonify, render_template, g, abort, has_request_context
 from flask_cors import CORS
+from werkzeug.serving import make_server
+import bisect
+import gc
+import heapq
+import itertools
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait as wait_futures
 import json
+import marshal
+import math
+import mmap
+import re
+from collections import Counter, OrderedDict, deque
+from contextlib import nullcontext
 from datetime import datetime
+import os
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
 import uuid
 
+import pubsub
+from cluster import HashRing, NodeClient
+
 app = Flask(__name__)
 CORS(app)
 
+# Page themes, picked per request with ?theme= (MESSAGE_BOARD_THEME sets
+# the default). Both pages are rendered once, below, when the module loads.
+THEMES = {
+    'normal': 'normal.html',  # Ultra-minimal dark theme with name, color, and shape settings
+    'cosmic': 'cosmic.html',  # Same page on a starry background with glass-morphism UI
+}
+DEFAULT_THEME = os.environ.get('MESSAGE_BOARD_THEME', 'normal')
+if DEFAULT_THEME not in THEMES:
+    DEFAULT_THEME = 'normal'
+
+with app.app_context():
+    PAGES = {theme: render_template(template).encode() for theme, template in THEMES.items()}
+
 # Store messages and user info
 messages = {}
 user_info = {}
 
+# Keep only the last N messages per room
+MAX_MESSAGES_PER_ROOM = 200
+# Upper bound on messages accepted by one /send/batch request
+MAX_BATCH_SIZE = 500
+# Limits for /poll: rooms per request and seconds a long-poll may wait
+MAX_POLL_ROOMS = 500
+MAX_POLL_WAIT = 25
+
+# One lock per room guards appends and trims; room_versions is bumped
+# (and new_messages notified) once per append so readers can wait on it
+room_locks = {}
+room_locks_guard = threading.Lock()
+room_versions = {}
+new_messages = threading.Condition()
+
+# Every message gets a per-room sequence number; message_seqs maps
+# id -> seq so cursors resolve without scanning the room
+room_seqs = {}
+message_seqs = {}
+# How many of a room's live messages are real messages rather than
+# change-log entries (edits, reactions, expiries)
+room_counts = {}
+# Real messages ever posted to each room
+room_posted = {}
+
+# Live profiles mode (MESSAGE_BOARD_LIVE_PROFILES=1): messages store only
+# sender_id and name/color/shape are joined in at read time, so profile
+# changes show up on old messages too. profile_version is bumped on every
+# profile change; room_views memoizes the joined (and serialized) room
+# per (room version, profile version).
+LIVE_PROFILES = os.environ.get('MESSAGE_BOARD_LIVE_PROFILES', '') == '1'
+profile_version = 0
+room_views = {}
+
+# Request and storage metrics served by /metrics. Latency histograms use
+# cumulative Prometheus buckets (seconds); room_bytes is an approximate
+# per-room footprint kept up to date on append/trim.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 10, 30)
+metrics_lock = threading.Lock()
+route_latency = {}
+poll_results = {'hit': 0, 'miss': 0}
+messages_total = 0
+room_bytes = {}
+
+# Admin tools, all off unless configured: MESSAGE_BOARD_ADMIN_TOKEN enables
+# /admin/* (sampling profiler, slow log); MESSAGE_BOARD_SLOW_MS logs requests
+# slower than that many milliseconds
+ADMIN_TOKEN = os.environ.get('MESSAGE_BOARD_ADMIN_TOKEN', '')
+SLOW_REQUEST_MS = float(os.environ.get('MESSAGE_BOARD_SLOW_MS', '0') or 0)
+MAX_PROFILE_SECONDS = 60
+profiler_lock = threading.Lock()
+slow_requests = deque(maxlen=200)
+
+# Per-phase request tracing: MESSAGE_BOARD_TRACE=1 adds a Server-Timing
+# header to every response, MESSAGE_BOARD_TRACE_LOG=<path> also appends
+# one JSON line per request to that file
+TRACE_LOG = os.environ.get('MESSAGE_BOARD_TRACE_LOG', '')
+TRACING = os.environ.get('MESSAGE_BOARD_TRACE', '') == '1' or bool(TRACE_LOG)
+trace_log_lock = threading.Lock()
+trace_log_file = None
+
+# Token-bucket rate limits as "rate/second:burst"; an empty value (or a
+# rate of 0) disables that limit. Clients are keyed by sender_id when the
+# request carries one, otherwise by IP.
+SEND_LIMIT = os.environ.get('MESSAGE_BOARD_SEND_LIMIT', '5:20')
+ROOM_SEND_LIMIT = os.environ.get('MESSAGE_BOARD_ROOM_SEND_LIMIT', '50:200')
+POLL_LIMIT = os.environ.get('MESSAGE_BOARD_POLL_LIMIT', '20:40')
+# Most buckets kept per limiter; the least recently used are dropped first
+MAX_RATE_BUCKETS = 100000
+
+# Full-text search: per-room inverted index token -> {seq: term count},
+# filled as messages are appended, and search_impacts token -> {term count:
+# SortedSeqs} so ranking can start from the best matches and stop early.
+# search_docs keeps the indexed messages
+# (including ones trimmed from the live room) up to SEARCH_HISTORY per room;
+# search_floor is the oldest seq still kept. Rooms restored from a
+# snapshot wait in search_pending until first needed, so startup doesn't
+# pay for tokenizing everything.
+SEARCH_HISTORY = int(os.environ.get('MESSAGE_BOARD_SEARCH_HISTORY', '100000'))
+MAX_SEARCH_RESULTS = 100
+TOKEN_RE = re.compile(r'\w+')
+search_index = {}
+search_impacts = {}
+search_docs = {}
+search_floor = {}
+search_pending = {}
+
+# Room directory for /rooms, maintained as things happen rather than by
+# walking every room: room_activity is ordered least to most recently
+# active (last message, epoch ms), and room_ranks orders rooms by live
+# message count and by readers present (rooms without readers left out).
+# Both are guarded by activity_lock.
+MAX_ROOMS_PAGE = 500
+room_activity = OrderedDict()
+activity_lock = threading.Lock()
+
+# Presence: polls carrying a user id are heartbeats that keep the user in
+# room_presence[room] (user -> typing?) for PRESENCE_TTL seconds. Expiry
+# runs through a timer wheel, so a heartbeat is O(1) however many clients
+# are connected. presence_versions changes whenever a room's presence does.
+PRESENCE_TTL = 10
+room_presence = {}
+presence_versions = {}
+
+# Read receipts from poll cursors: user_reads[user][room] is (seq, posted)
+# for the last message the user had when polling, posted being the room's
+# room_posted count at that message. read_positions[room] keeps the seqs
+# sorted so "seen by" is a bisect, and unread counts are just room_posted
+# minus the read count (seqs also number edits, reactions, ...)
+user_reads = {}
+read_positions = {}
+receipts_lock = threading.Lock()
+
+# Cluster mode: MESSAGE_BOARD_CLUSTER lists every node's base URL and
+# MESSAGE_BOARD_NODE is this node's own. Rooms are spread over the nodes by
+# consistent hashing; any node takes any request and forwards it to the
+# room's owner. Nodes vouch for forwarded requests with the admin token.
+CLUSTER_NODES = [url.strip().rstrip('/') for url in os.environ.get('MESSAGE_BOARD_CLUSTER', '').split(',') if url.strip()]
+NODE_URL = os.environ.get('MESSAGE_BOARD_NODE', '').rstrip('/')
+FORWARDED_HEADER = 'X-Cluster-Forwarded'
+cluster_ring = HashRing(CLUSTER_NODES) if CLUSTER_NODES else None
+cluster_pool = ThreadPoolExecutor(max_workers=256) if CLUSTER_NODES else None
+node_clients = {}
+node_clients_lock = threading.Lock()
+rebalance_requested = threading.Event()
+rebalancer = None
+# Polls split across nodes wait on each node in steps this long, so the
+# ones left over when another node answers first soon give up
+CLUSTER_POLL_SLICE = 2
+# Profile changes go to each other node from its own queue (at most
+# MAX_PROFILE_SHARES waiting), so a slow or dead node holds up neither
+# /user nor the other nodes
+MAX_PROFILE_SHARES = 10000
+profile_shares = {}
+profile_shares_lock = threading.Lock()
+
+# Pub/sub between instances behind a load balancer: MESSAGE_BOARD_PUBSUB is
+# "memory" (in-process) or redis://host:port (Redis or the stand-in in
+# pubsub.py). Appends are published on "room:<name>"; each node subscribes
+# only to rooms its clients read (bus_rooms: room -> last read, monotonic)
+# and drops rooms nobody has read for BUS_IDLE_SECONDS.
+PUBSUB_URL = os.environ.get('MESSAGE_BOARD_PUBSUB', '')
+BUS_IDLE_SECONDS = 60
+NODE_ID = uuid.uuid4().hex
+bus = None
+bus_rooms = {}
+bus_lock = threading.Lock()
+bus_messages = {'in': 0, 'out': 0}
+
+# Replication: every change (appends, room imports, profiles) is numbered
+# and kept in replication_log as (offset, entry) for followers to tail via
+# /replication/stream. A node started with MESSAGE_BOARD_FOLLOW=<primary
+# url> is a read-only replica until promoted; replica_state tracks how far
+# it has got (offset) against the primary's head.
+REPLICATION_LOG_SIZE = 10000
+MAX_REPLICATION_BATCH = 1000
+replication_log = deque(maxlen=REPLICATION_LOG_SIZE)
+replication_head = 0
+replication_changed = threading.Condition()
+replica_of = os.environ.get('MESSAGE_BOARD_FOLLOW', '').rstrip('/') or None
+replica_state = {'offset': 0, 'head': 0, 'caught_up_at': None, 'waiting': False}
+WRITE_ENDPOINTS = {'send_message', 'send_batch', 'edit_message', 'delete_message', 'react',
+                   'update_user', 'cluster_import', 'retention'}
+
+# Snapshots: with MESSAGE_BOARD_SNAPSHOT=<path> the whole state (rooms with
+# their search history, and profiles in creation order so default colors
+# carry on where they left off) is written there as one marshal blob every
+# MESSAGE_BOARD_SNAPSHOT_SECONDS, and loaded back at startup. A forked
+# child does the writing where the OS has fork(), so request threads never
+# wait on it.
+SNAPSHOT_PATH = os.environ.get('MESSAGE_BOARD_SNAPSHOT', '')
+SNAPSHOT_SECONDS = float(os.environ.get('MESSAGE_BOARD_SNAPSHOT_SECONDS', '60') or 60)
+SNAPSHOT_MAGIC = b'MBSNAP1\n'
+snapshot_lock = threading.Lock()
+snapshot_stats = {'head': None, 'written_at': None, 'seconds': None, 'bytes': None, 'load_seconds': None}
+
+# Graceful shutdown on SIGTERM/SIGINT: stop accepting connections, answer
+# new requests on open connections with 503, wake long-polls with
+# "reconnect", wait for in-flight requests, flush the trace log and write a
+# final snapshot, all within MESSAGE_BOARD_SHUTDOWN_SECONDS
+SHUTDOWN_SECONDS = float(os.environ.get('MESSAGE_BOARD_SHUTDOWN_SECONDS', '20') or 20)
+shutting_down = False
+inflight_requests = 0
+inflight_changed = threading.Condition()
+
+# Push over Server-Sent Events (/stream): appends are fanned out into a
+# bounded queue per subscriber and each connection's own thread drains it,
+# so a stalled reader never holds up the room. A full queue applies the
+# subscriber's policy: "resync" (drop everything, tell the client to
+# refetch from its cursor), "coalesce" (merge queued batches into one) or
+# "disconnect".
+STREAM_QUEUE_LIMIT = int(os.environ.get('MESSAGE_BOARD_STREAM_QUEUE', '64') or 64)
+STREAM_POLICY = os.environ.get('MESSAGE_BOARD_STREAM_POLICY', 'resync')
+STREAM_POLICIES = ('resync', 'coalesce', 'disconnect')
+STREAM_KEEPALIVE = 15
+stream_subscribers = {}
+stream_lock = threading.Lock()
+stream_overflows = Counter()
+
+# Retention: each room keeps at most max_count messages and max_bytes of
+# them (trimmed on append) and none older than max_age seconds. Age expiry
+# is driven by retention_heap, one (deadline ms, room) entry per room for
+# its oldest message, so a sweep only touches rooms that are due. Expired
+# messages are removed by appending an "expire" entry, which readers get
+# through their cursor like any message. 0 means no limit (for max_count,
+# MAX_MESSAGES_PER_ROOM).
+RETENTION_DEFAULTS = {
+    'max_age': float(os.environ.get('MESSAGE_BOARD_RETENTION_AGE', '0') or 0),
+    'max_count': 0,
+    'max_bytes': int(os.environ.get('MESSAGE_BOARD_RETENTION_BYTES', '0') or 0),
+}
+room_retention = {}
+retention_heap = []
+retention_scheduled = set()
+retention_lock = threading.Lock()
+retention_sweeper = None
+
+# Reactions: each message carries only its counts ("reactions": {emoji:
+# count}); who reacted with what is kept here, message_reactors[room][id]
+# = {user: [emoji, ...]}, bounded per user and per message. Changes are
+# "react" entries with the emoji's new absolute count, so a newer one for
+# the same message and emoji folds the older one away.
+MAX_REACTIONS_PER_USER = 3
+MAX_REACTION_KINDS = 20
+MAX_EMOJI_LENGTH = 16
+message_reactors = {}
+
+# An entry that supersedes another (a newer edit, reaction count, ...)
+# keeps the older one's id as a cursor in "folds", up to MAX_FOLDS of them;
+# clients holding an older one get the whole room instead
+MAX_FOLDS = 20
+# Change-log entries don't count against a room's max_count/max_bytes;
+# past MAX_ROOM_ENTRIES of them the oldest entries go (never messages)
+MAX_ROOM_ENTRIES = 500
+
+# Global change counter plus a short log of (version, room) so long-polls
+# watching many rooms only look at the rooms that actually changed
+global_version = 0
+recent_changes = deque(maxlen=10000)
+
 # Available colors for users to choose from
 AVAILABLE_COLORS = [
     '#1a73e8',  # Blue
@@ -30,8 +305,238 @@ AVAILABLE_COLORS = [
 # Available avatar shapes
 AVATAR_SHAPES = ['square', 'circle', 'diamond']
 
+class TimerWheel:
+    """Keys that expire after a number of seconds, kept in one-second slots.
+
+    touch() is O(1); expire() only visits the slots the clock has moved
+    past. Re-touched keys leave stale entries behind that are skipped.
+    """
+    
+    def __init__(self, max_ttl):
+        self.slots = [[] for _ in range(max_ttl + 2)]
+        self.deadlines = {}
+        self.tick = int(time.monotonic())
+    
+    def touch(self, key, ttl):
+        deadline = int(time.monotonic()) + min(ttl, len(self.slots) - 2)
+        if self.deadlines.get(key) != deadline:
+            self.deadlines[key] = deadline
+            self.slots[deadline % len(self.slots)].append(key)
+    
+    def expire(self):
+        """Remove and return the keys whose deadline has passed"""
+        now = int(time.monotonic())
+        size = len(self.slots)
+        expired = []
+        for tick in range(max(self.tick, now - size), now):
+            slot = self.slots[tick % size]
+            keep = []
+            for key in slot:
+                deadline = self.deadlines.get(key)
+                if deadline is None:
+                    continue
+                if deadline < now:
+                    del self.deadlines[key]
+                    expired.append(key)
+                elif deadline % size == tick % size:
+                    keep.append(key)
+            self.slots[tick % size] = keep
+        self.tick = max(self.tick, now)
+        return expired
+
+class Ranking:
+    """Keys ordered by a count, for paging from the top without sorting.
+
+    Keys with the same count share a bucket (in the order they got there)
+    and the distinct counts are kept sorted, so set() is a bisect and a
+    page only visits the buckets above it.
+    """
+    
+    def __init__(self):
+        self.counts = {}
+        self.buckets = {}
+        self.levels = []
+    
+    def __len__(self):
+        return len(self.counts)
+    
+    def set(self, key, count):
+        old = self.counts.get(key)
+        if old == count:
+            return
+        if old is not None:
+            self._leave(key, old)
+        self.counts[key] = count
+        bucket = self.buckets.get(count)
+        if bucket is None:
+            bucket = self.buckets[count] = {}
+            bisect.insort(self.levels, count)
+        bucket[key] = None
+    
+    def discard(self, key):
+        old = self.counts.pop(key, None)
+        if old is not None:
+            self._leave(key, old)
+    
+    def _leave(self, key, count):
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+            del self.levels[bisect.bisect_left(self.levels, count)]
+    
+    def top(self, offset, limit):
+        """Keys offset..offset+limit, highest count first"""
+        page = []
+        for count in reversed(self.levels):
+            bucket = self.buckets[count]
+            if offset >= len(bucket):
+                offset -= len(bucket)
+                continue
+            page.extend(itertools.islice(bucket, offset, offset + limit - len(page)))
+            offset = 0
+            if len(page) >= limit:
+                break
+        return page
+
+class SortedSeqs:
+    """Ascending seqs that are cheap to add at the end and to remove from
+    the front, the two ends the search history grows and trims at"""
+    
+    __slots__ = ('seqs', 'start')
+    
+    def __init__(self):
+        self.seqs = []
+        self.start = 0
+    
+    def __len__(self):
+        return len(self.seqs) - self.start
+    
+    def add(self, seq):
+        if not self.seqs or self.seqs[-1] < seq:
+            self.seqs.append(seq)
+        else:
+            bisect.insort(self.seqs, seq, self.start)
+    
+    def remove(self, seq):
+        index = bisect.bisect_left(self.seqs, seq, self.start)
+        if index == len(self.seqs) or self.seqs[index] != seq:
+            return
+        if index > self.start:
+            del self.seqs[index]
+            return
+        # Leave the slot behind and compact once half the list is gone
+        self.start += 1
+        if self.start * 2 > len(self.seqs):
+            del self.seqs[:self.start]
+            self.start = 0
+
+class RateLimiter:
+    """Token buckets per key, holding at most `max_keys` buckets"""
+    
+    def __init__(self, spec, max_keys=MAX_RATE_BUCKETS):
+        rate, _, burst = (spec or '0').partition(':')
+        self.rate = float(rate or 0)
+        self.burst = float(burst or rate or 0)
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def take(self, key, cost=1):
+        """Spend `cost` tokens from key's bucket. Returns 0 when allowed,
+        otherwise the seconds to wait before retrying."""
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.pop(key, None)
+            if bucket is None:
+                bucket = [self.burst, now]
+                if len(self.buckets) >= self.max_keys:
+                    self.buckets.popitem(last=False)
+            # Re-inserting keeps the dict in least-recently-used order
+            self.buckets[key] = bucket
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens >= cost:
+                bucket[0] = tokens - cost
+                return 0
+            bucket[0] = tokens
+            return (cost - tokens) / self.rate
+
+class Subscriber:
+    """Bounded outbound queue of message batches for one /stream client"""
+    
+    def __init__(self, room, policy, connection=None, limit=STREAM_QUEUE_LIMIT):
+        self.room = room
+        self.connection = connection
+        self.policy = policy
+        self.limit = limit
+        self.batches = deque()
+        self.resync = False
+        self.closed = None
+        self.ready = threading.Condition()
+    
+    def offer(self, batch):
+        """Queue a batch without ever blocking on the client"""
+        with self.ready:
+            if self.closed:
+                return
+            if len(self.batches) >= self.limit:
+                with metrics_lock:
+                    stream_overflows[self.policy] += 1
+                if self.policy == 'disconnect':
+                    self.closed = 'overflow'
+                    # The client's thread may be stuck writing to it
+                    if self.connection is not None:
+                        try:
+                            self.connection.shutdown(socket.SHUT_RDWR)
+                        except OSError:
+                            pass
+                elif self.policy == 'coalesce' and \
+                        sum(map(len, self.batches)) + len(batch) <= MAX_MESSAGES_PER_ROOM:
+                    merged = [message for queued in self.batches for message in queued]
+                    self.batches.clear()
+                    self.batches.append(merged + batch)
+                else:
+                    # resync, or too much to coalesce: the client refetches
+                    self.batches.clear()
+                    self.resync = True
+            else:
+                self.batches.append(batch)
+            self.ready.notify()
+    
+    def close(self, reason):
+        with self.ready:
+            self.closed = reason
+            self.ready.notify()
+    
+    def next(self, timeout):
+        """Wait for the next item: ('closed', reason), ('resync', None),
+        ('batch', messages) or (None, None) on timeout"""
+        with self.ready:
+            if not self.batches and not self.resync and not self.closed:
+                self.ready.wait(timeout)
+            if self.closed:
+                return 'closed', self.closed
+            if self.resync:
+                self.resync = False
+                return 'resync', None
+            if self.batches:
+                return 'batch', self.batches.popleft()
+            return None, None
+
+send_limiter = RateLimiter(SEND_LIMIT)
+room_send_limiter = RateLimiter(ROOM_SEND_LIMIT)
+poll_limiter = RateLimiter(POLL_LIMIT)
+
+presence_wheel = TimerWheel(PRESENCE_TTL + MAX_POLL_WAIT)
+room_ranks = {'messages': Ranking(), 'readers': Ranking()}
+presence_sweeper = None
+
 def get_user_info(user_id):
     """Get or create user info with random color and default settings"""
+    global profile_version
     if user_id not in user_info:
         # Assign a color based on user index
         color_index = len(user_info) % len(AVAILABLE_COLORS)
@@ -42,1050 +547,859 @@ def get_user_info(user_id):
             'name': default_name,
             'shape': 'square'  # Default shape
         }
+        profile_version += 1
+        record_change({'type': 'profile', 'user_id': user_id, 'profile': user_info[user_id]})
     return user_info[user_id]
 
-# Ultra-minimal dark theme with name, color, and shape settings
-HTML_TEMPLATE = '''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Message Board</title>
-    <style>
-        :root {
-            --bg: #000000;
-            --bg-light: #111111;
-            --border: #222222;
-            --text: #ffffff;
-            --text-light: #888888;
-            --accent: #1a73e8;
-            --accent-hover: #0d62d9;
-        }
-        
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background: var(--bg);
-            color: var(--text);
-            height: 100vh;
-            overflow: hidden;
-        }
-        
-        #app {
-            height: 100vh;
-            display: flex;
-            flex-direction: column;
-            max-width: 800px;
-            margin: 0 auto;
-        }
-        
-        .header {
-            padding: 20px;
-            border-bottom: 1px solid var(--border);
-            display: flex;
-            align-items: center;
-            justify-content: space-between;
-            gap: 20px;
-        }
-        
-        .header h1 {
-            font-size: 20px;
-            font-weight: 600;
-            white-space: nowrap;
-        }
-        
-        .user-info {
-            display: flex;
-            align-items: center;
-            gap: 12px;
-        }
-        
-        .user-avatar {
-            width: 32px;
-            height: 32px;
-            border-radius: 6px;
-            font-size: 12px;
-            font-weight: 600;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            flex-shrink: 0;
-            cursor: pointer;
-            transition: all 0.2s;
-            border: 2px solid transparent;
-        }
-        
-        .user-avatar:hover {
-            opacity: 0.9;
-            border-color: var(--text-light);
-        }
-        
-        .user-avatar.circle {
-            border-radius: 50%;
-        }
-        
-        .user-avatar.diamond {
-            border-radius: 4px;
-            transform: rotate(45deg);
-        }
-        
-        .user-avatar.diamond span {
-            transform: rotate(-45deg);
-        }
-        
-        .user-name {
-            font-size: 14px;
-            color: var(--text-light);
-            cursor: pointer;
-            padding: 4px 8px;
-            border-radius: 4px;
-            transition: background 0.2s;
-        }
-        
-        .user-name:hover {
-            background: var(--bg-light);
-        }
-        
-        .status {
-            font-size: 12px;
-            color: var(--text-light);
-            display: flex;
-            align-items: center;
-            gap: 6px;
-        }
-        
-        .status::before {
-            content: '';
-            width: 6px;
-            height: 6px;
-            background: #34a853;
-            border-radius: 50%;
-        }
-        
-        .messages {
-            flex: 1;
-            overflow-y: auto;
-            padding: 20px;
-            display: flex;
-            flex-direction: column;
-            gap: 16px;
-        }
-        
-        .message {
-            display: flex;
-            gap: 12px;
-            opacity: 0;
-            animation: fadeIn 0.2s ease forwards;
-        }
-        
-        @keyframes fadeIn {
-            to { opacity: 1; }
-        }
-        
-        .avatar {
-            width: 32px;
-            height: 32px;
-            border-radius: 6px;
-            font-size: 12px;
-            font-weight: 600;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            flex-shrink: 0;
-        }
-        
-        .avatar.circle {
-            border-radius: 50%;
-        }
-        
-        .avatar.diamond {
-            border-radius: 4px;
-            transform: rotate(45deg);
-        }
-        
-        .avatar.diamond span {
-            transform: rotate(-45deg);
-        }
-        
-        .content {
-            flex: 1;
-        }
-        
-        .meta {
-            display: flex;
-            align-items: center;
-            gap: 8px;
-            margin-bottom: 4px;
-        }
-        
-        .sender {
-            font-weight: 500;
-            font-size: 14px;
-        }
-        
-        .time {
-            font-size: 12px;
-            color: var(--text-light);
-        }
-        
-        .text {
-            font-size: 15px;
-            line-height: 1.4;
-        }
-        
-        .input-area {
-            padding: 20px;
-            border-top: 1px solid var(--border);
-        }
-        
-        .input-wrapper {
-            display: flex;
-            gap: 10px;
-            align-items: flex-end;
-        }
-        
-        textarea {
-            flex: 1;
-            background: var(--bg-light);
-            border: 1px solid var(--border);
-            border-radius: 12px;
-            padding: 12px 16px;
-            color: var(--text);
-            font-size: 15px;
-            font-family: inherit;
-            resize: none;
-            line-height: 1.4;
-            min-height: 44px;
-            max-height: 120px;
-            outline: none;
-            transition: border-color 0.15s;
-        }
-        
-        textarea:focus {
-            border-color: var(--accent);
-        }
-        
-        button {
-            background: var(--accent);
-            color: white;
-            border: none;
-            width: 36px;
-            height: 36px;
-            border-radius: 10px;
-            cursor: pointer;
-            transition: background-color 0.15s;
-            flex-shrink: 0;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-        }
-        
-        button:hover {
-            background: var(--accent-hover);
-        }
-        
-        button:disabled {
-            background: var(--border);
-            cursor: not-allowed;
-        }
-        
-        .share {
-            padding: 12px 20px;
-            border-top: 1px solid var(--border);
-            font-size: 13px;
-            color: var(--text-light);
-        }
-        
-        .url {
-            display: flex;
-            gap: 8px;
-            margin-top: 6px;
-        }
-        
-        .url span {
-            background: var(--bg-light);
-            padding: 8px 12px;
-            border-radius: 6px;
-            font-family: monospace;
-            font-size: 12px;
-            flex: 1;
-            overflow: hidden;
-            text-overflow: ellipsis;
-            white-space: nowrap;
-        }
-        
-        .url button {
-            background: transparent;
-            border: 1px solid var(--border);
-            color: var(--text-light);
-            font-size: 12px;
-            width: auto;
-            height: auto;
-            padding: 6px 12px;
-        }
-        
-        .url button:hover {
-            background: var(--bg-light);
-            color: var(--text);
-        }
-        
-        .empty {
-            height: 100%;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            color: var(--text-light);
-            font-size: 14px;
-        }
-        
-        /* Modal for user settings */
-        .modal-overlay {
-            position: fixed;
-            top: 0;
-            left: 0;
-            right: 0;
-            bottom: 0;
-            background: rgba(0, 0, 0, 0.7);
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            z-index: 1000;
-            opacity: 0;
-            visibility: hidden;
-            transition: all 0.3s;
-        }
-        
-        .modal-overlay.visible {
-            opacity: 1;
-            visibility: visible;
-        }
-        
-        .modal {
-            background: var(--bg);
-            border: 1px solid var(--border);
-            border-radius: 12px;
-            padding: 24px;
-            width: 90%;
-            max-width: 400px;
-            transform: translateY(20px);
-            transition: transform 0.3s;
-        }
-        
-        .modal-overlay.visible .modal {
-            transform: translateY(0);
-        }
-        
-        .modal h2 {
-            font-size: 18px;
-            margin-bottom: 20px;
-        }
-        
-        .modal label {
-            display: block;
-            font-size: 14px;
-            margin-bottom: 8px;
-            color: var(--text-light);
-        }
-        
-        .modal input {
-            width: 100%;
-            background: var(--bg-light);
-            border: 1px solid var(--border);
-            border-radius: 8px;
-            padding: 12px;
-            color: var(--text);
-            font-size: 15px;
-            margin-bottom: 20px;
-            outline: none;
-        }
-        
-        .modal input:focus {
-            border-color: var(--accent);
-        }
-        
-        .color-picker, .shape-picker {
-            margin-bottom: 20px;
-        }
-        
-        .color-grid {
-            display: grid;
-            grid-template-columns: repeat(6, 1fr);
-            gap: 8px;
-            margin-top: 8px;
-        }
-        
-        .color-option {
-            width: 32px;
-            height: 32px;
-            border-radius: 6px;
-            cursor: pointer;
-            transition: transform 0.2s, border-color 0.2s;
-            border: 2px solid transparent;
-        }
-        
-        .color-option:hover {
-            transform: scale(1.1);
-        }
-        
-        .color-option.selected {
-            border-color: white;
-            transform: scale(1.1);
-        }
-        
-        .shape-grid {
-            display: grid;
-            grid-template-columns: repeat(3, 1fr);
-            gap: 8px;
-            margin-top: 8px;
-        }
-        
-        .shape-option {
-            width: 32px;
-            height: 32px;
-            background: var(--bg-light);
-            border: 2px solid var(--border);
-            border-radius: 6px;
-            cursor: pointer;
-            transition: all 0.2s;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            color: var(--text);
-        }
-        
-        .shape-option:hover {
-            border-color: var(--accent);
-            transform: scale(1.1);
-        }
-        
-        .shape-option.selected {
-            border-color: var(--accent);
-            background: var(--bg-light);
-            transform: scale(1.1);
-        }
-        
-        .shape-option.circle {
-            border-radius: 50%;
-        }
-        
-        .shape-option.diamond {
-            border-radius: 4px;
-            transform: rotate(45deg) scale(1);
-        }
-        
-        .shape-option.diamond:hover {
-            transform: rotate(45deg) scale(1.1);
-        }
-        
-        .shape-option.selected.diamond {
-            transform: rotate(45deg) scale(1.1);
-        }
-        
-        .modal-buttons {
-            display: flex;
-            gap: 10px;
-            justify-content: flex-end;
-        }
-        
-        .modal-buttons button {
-            width: auto;
-            height: auto;
-            padding: 8px 16px;
-        }
-        
-        .modal-buttons .cancel {
-            background: var(--bg-light);
-            color: var(--text);
-        }
-        
-        .modal-buttons .cancel:hover {
-            background: var(--border);
-        }
-        
-        /* Hide scrollbar for Chrome, Safari and Opera */
-        .messages::-webkit-scrollbar {
-            display: none;
-        }
-        
-        /* Hide scrollbar for IE, Edge and Firefox */
-        .messages {
-            -ms-overflow-style: none;
-            scrollbar-width: none;
-        }
-        
-        /* Smooth scrolling */
-        .messages {
-            scroll-behavior: smooth;
-        }
-    </style>
-</head>
-<body>
-    <div id="app">
-        <div class="header">
-            <h1>Message Board</h1>
-            <div class="user-info">
-                <div class="user-avatar" id="userAvatar" onclick="showSettingsModal()">
-                    <span>ME</span>
-                </div>
-                <div class="user-name" onclick="showSettingsModal()" id="userName">User</div>
-            </div>
-            <div class="status">Online</div>
-        </div>
-        
-        <div class="messages" id="messages">
-            <!-- Messages appear here -->
-        </div>
-        
-        <div class="input-area">
-            <div class="input-wrapper">
-                <textarea 
-                    id="input" 
-                    placeholder="Type a message..."
-                    rows="1"
-                    autofocus
-                ></textarea>
-                <button id="send" onclick="sendMessage()">
-                    →
-                </button>
-            </div>
-        </div>
-        
-        <div class="share">
-            Share this link:
-            <div class="url">
-                <span id="shareUrl">Loading...</span>
-                <button onclick="copyLink()">Copy</button>
-            </div>
-        </div>
-        
-        <!-- Settings Modal -->
-        <div class="modal-overlay" id="settingsModal">
-            <div class="modal">
-                <h2>Your Profile</h2>
-                
-                <label for="nameInput">Display Name</label>
-                <input 
-                    type="text" 
-                    id="nameInput" 
-                    placeholder="Enter your name"
-                    maxlength="20"
-                >
-                
-                <div class="color-picker">
-                    <label>Color</label>
-                    <div class="color-grid" id="colorGrid">
-                        <!-- Colors will be added here -->
-                    </div>
-                </div>
-                
-                <div class="shape-picker">
-                    <label>Avatar Shape</label>
-                    <div class="shape-grid" id="shapeGrid">
-                        <!-- Shapes will be added here -->
-                    </div>
-                </div>
-                
-                <div class="modal-buttons">
-                    <button class="cancel" onclick="hideSettingsModal()">Cancel</button>
-                    <button onclick="saveSettings()">Save</button>
-                </div>
-            </div>
-        </div>
-    </div>
-
-    <script>
-        // Available colors (must match server's colors)
-        const AVAILABLE_COLORS = [
-            '#1a73e8', '#34a853', '#ea4335', '#fbbc04', '#8e44ad', '#16a085',
-            '#e74c3c', '#3498db', '#2ecc71', '#e67e22', '#9b59b6', '#1abc9c'
-        ];
-        
-        // Available avatar shapes
-        const AVATAR_SHAPES = ['square', 'circle', 'diamond'];
-        
-        // Generate unique user ID
-        const userId = 'user-' + Math.random().toString(36).substr(2, 9);
-        let userColor = AVAILABLE_COLORS[0];
-        let userName = 'User';
-        let userShape = 'square';
-        let lastMessageId = null;
-        let isAtBottom = true;
-        
-        // Load user info from localStorage
-        function loadUserInfo() {
-            const savedName = localStorage.getItem('messageBoard_userName');
-            const savedColor = localStorage.getItem('messageBoard_userColor');
-            const savedShape = localStorage.getItem('messageBoard_userShape');
-            
-            if (savedName) {
-                userName = savedName;
-                document.getElementById('userName').textContent = userName;
-            }
-            
-            if (savedColor && AVAILABLE_COLORS.includes(savedColor)) {
-                userColor = savedColor;
-            } else {
-                // Assign a color based on user ID hash
-                const hash = userId.split('').reduce((acc, char) => acc + char.charCodeAt(0), 0);
-                userColor = AVAILABLE_COLORS[hash % AVAILABLE_COLORS.length];
-                localStorage.setItem('messageBoard_userColor', userColor);
-            }
-            
-            if (savedShape && AVATAR_SHAPES.includes(savedShape)) {
-                userShape = savedShape;
-            } else {
-                localStorage.setItem('messageBoard_userShape', userShape);
-            }
-            
-            // Update avatar
-            updateAvatar();
-            
-            // Send user info to server
-            updateUserInfo();
-        }
-        
-        // Update avatar display
-        function updateAvatar() {
-            const avatarEl = document.getElementById('userAvatar');
-            const initials = userName.substring(0, 2).toUpperCase();
-            
-            // Update text
-            avatarEl.innerHTML = `<span>${initials}</span>`;
-            
-            // Update color
-            avatarEl.style.background = userColor;
-            
-            // Update shape classes - remove all shape classes first
-            avatarEl.className = 'user-avatar';
-            if (userShape !== 'square') {
-                avatarEl.classList.add(userShape);
-            }
-        }
-        
-        // Send user info to server
-        async function updateUserInfo() {
-            try {
-                await fetch('/user', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({
-                        user_id: userId,
-                        name: userName,
-                        color: userColor,
-                        shape: userShape
-                    })
-                });
-            } catch (error) {
-                console.error('Failed to update user info:', error);
-            }
-        }
-        
-        // Get room from URL
-        function getRoom() {
-            const params = new URLSearchParams(window.location.search);
-            let room = params.get('room');
-            if (!room) {
-                room = 'main';
-                history.replaceState({}, '', `?room=${room}`);
-            }
-            return room;
-        }
-        
-        const room = getRoom();
-        const messagesEl = document.getElementById('messages');
-        const inputEl = document.getElementById('input');
-        const sendBtn = document.getElementById('send');
-        const shareUrlEl = document.getElementById('shareUrl');
-        const settingsModal = document.getElementById('settingsModal');
-        const nameInput = document.getElementById('nameInput');
-        const colorGrid = document.getElementById('colorGrid');
-        const shapeGrid = document.getElementById('shapeGrid');
-        
-        // Initialize
-        loadUserInfo();
-        shareUrlEl.textContent = location.origin + location.pathname + '?room=' + room;
-        
-        // Populate color grid
-        function populateColorGrid() {
-            colorGrid.innerHTML = '';
-            AVAILABLE_COLORS.forEach(color => {
-                const div = document.createElement('div');
-                div.className = 'color-option';
-                div.style.background = color;
-                div.dataset.color = color;
-                
-                if (color === userColor) {
-                    div.classList.add('selected');
-                }
-                
-                div.addEventListener('click', () => {
-                    // Remove selected from all colors
-                    document.querySelectorAll('.color-option').forEach(el => {
-                        el.classList.remove('selected');
-                    });
-                    // Add selected to clicked color
-                    div.classList.add('selected');
-                });
-                
-                colorGrid.appendChild(div);
-            });
-        }
-        
-        // Populate shape grid - simplified, just empty boxes
-        function populateShapeGrid() {
-            shapeGrid.innerHTML = '';
-            AVATAR_SHAPES.forEach(shape => {
-                const div = document.createElement('div');
-                div.className = `shape-option ${shape}`;
-                div.dataset.shape = shape;
-                div.title = shape.charAt(0).toUpperCase() + shape.slice(1);
-                
-                if (shape === userShape) {
-                    div.classList.add('selected');
-                }
-                
-                div.addEventListener('click', () => {
-                    // Remove selected from all shapes
-                    document.querySelectorAll('.shape-option').forEach(el => {
-                        el.classList.remove('selected');
-                    });
-                    // Add selected to clicked shape
-                    div.classList.add('selected');
-                });
-                
-                shapeGrid.appendChild(div);
-            });
-        }
-        
-        // Settings modal functions
-        function showSettingsModal() {
-            nameInput.value = userName;
-            populateColorGrid();
-            populateShapeGrid();
-            settingsModal.classList.add('visible');
-            nameInput.focus();
-        }
-        
-        function hideSettingsModal() {
-            settingsModal.classList.remove('visible');
-        }
-        
-        async function saveSettings() {
-            const newName = nameInput.value.trim();
-            const selectedColorEl = document.querySelector('.color-option.selected');
-            const selectedShapeEl = document.querySelector('.shape-option.selected');
-            
-            const newColor = selectedColorEl ? selectedColorEl.dataset.color : userColor;
-            const newShape = selectedShapeEl ? selectedShapeEl.dataset.shape : userShape;
-            
-            let changed = false;
-            
-            if (newName && newName !== userName) {
-                userName = newName;
-                document.getElementById('userName').textContent = userName;
-                localStorage.setItem('messageBoard_userName', userName);
-                changed = true;
-            }
-            
-            if (newColor !== userColor) {
-                userColor = newColor;
-                localStorage.setItem('messageBoard_userColor', userColor);
-                changed = true;
-            }
-            
-            if (newShape !== userShape) {
-                userShape = newShape;
-                localStorage.setItem('messageBoard_userShape', userShape);
-                changed = true;
-            }
-            
-            if (changed) {
-                // Update avatar
-                updateAvatar();
-                
-                // Notify server
-                await updateUserInfo();
-                
-                // Reload messages to show new settings
-                await loadMessages();
-            }
-            
-            hideSettingsModal();
-        }
-        
-        // Auto-resize textarea
-        inputEl.addEventListener('input', function() {
-            this.style.height = 'auto';
-            this.style.height = (this.scrollHeight) + 'px';
-            sendBtn.disabled = this.value.trim() === '';
-        });
-        
-        // Send on Enter (without Shift)
-        inputEl.addEventListener('keydown', function(e) {
-            if (e.key === 'Enter' && !e.shiftKey) {
-                e.preventDefault();
-                if (this.value.trim()) {
-                    sendMessage();
-                }
-            }
-        });
-        
-        // Modal enter key
-        nameInput.addEventListener('keydown', function(e) {
-            if (e.key === 'Enter') {
-                saveSettings();
-            } else if (e.key === 'Escape') {
-                hideSettingsModal();
-            }
-        });
-        
-        // Track scroll position
-        messagesEl.addEventListener('scroll', function() {
-            const { scrollTop, scrollHeight, clientHeight } = this;
-            isAtBottom = scrollHeight - scrollTop - clientHeight < 50;
-        });
-        
-        // Smart message rendering - only update if needed
-        async function updateMessages() {
-            try {
-                const res = await fetch(`/messages?room=${room}&since=${lastMessageId || ''}`);
-                const newMessages = await res.json();
-                
-                if (newMessages.length === 0) return;
-                
-                // Find the last message that's already displayed
-                const existingIds = new Set(
-                    Array.from(messagesEl.children)
-                        .map(el => el.dataset.id)
-                        .filter(id => id)
-                );
-                
-                // Add only new messages
-                const messagesToAdd = newMessages.filter(msg => !existingIds.has(msg.id));
-                
-                if (messagesToAdd.length === 0) return;
-                
-                // Add new messages
-                messagesToAdd.forEach(msg => {
-                    const time = formatTime(msg.timestamp);
-                    const isMe = msg.sender_id === userId;
-                    const color = msg.sender_color;
-                    const name = msg.sender_name || 'User';
-                    const shape = msg.sender_shape || 'square';
-                    const initials = name.substring(0, 2).toUpperCase();
-                    
-                    const div = document.createElement('div');
-                    div.className = 'message';
-                    div.dataset.id = msg.id;
-                    
-                    // Create avatar with shape
-                    let avatarHTML = '';
-                    let avatarClass = 'avatar';
-                    if (shape === 'circle') {
-                        avatarClass += ' circle';
-                    } else if (shape === 'diamond') {
-                        avatarClass += ' diamond';
-                    }
-                    
-                    avatarHTML = `<div class="${avatarClass}" style="background: ${color}"><span>${initials}</span></div>`;
-                    
-                    div.innerHTML = `
-                        ${avatarHTML}
-                        <div class="content">
-                            <div class="meta">
-                                <span class="sender" style="color: ${color}">${isMe ? 'You' : name}</span>
-                                <span class="time">${time}</span>
-                            </div>
-                            <div class="text">${escapeHtml(msg.text)}</div>
-                        </div>
-                    `;
-                    
-                    messagesEl.appendChild(div);
-                    
-                    // Update last message ID
-                    lastMessageId = msg.id;
-                });
-                
-                // Scroll to bottom if user was already there
-                if (isAtBottom) {
-                    messagesEl.scrollTop = messagesEl.scrollHeight;
-                }
-                
-            } catch (error) {
-                console.error('Update failed:', error);
-            }
-        }
-        
-        // Initial load
-        async function loadMessages() {
-            try {
-                const res = await fetch(`/messages?room=${room}`);
-                const allMessages = await res.json();
-                
-                if (allMessages.length === 0) {
-                    messagesEl.innerHTML = '<div class="empty">No messages yet</div>';
-                    return;
-                }
-                
-                messagesEl.innerHTML = '';
-                
-                allMessages.forEach(msg => {
-                    const time = formatTime(msg.timestamp);
-                    const isMe = msg.sender_id === userId;
-                    const color = msg.sender_color;
-                    const name = msg.sender_name || 'User';
-                    const shape = msg.sender_shape || 'square';
-                    const initials = name.substring(0, 2).toUpperCase();
-                    
-                    const div = document.createElement('div');
-                    div.className = 'message';
-                    div.dataset.id = msg.id;
-                    
-                    // Create avatar with shape
-                    let avatarHTML = '';
-                    let avatarClass = 'avatar';
-                    if (shape === 'circle') {
-                        avatarClass += ' circle';
-                    } else if (shape === 'diamond') {
-                        avatarClass += ' diamond';
-                    }
-                    
-                    avatarHTML = `<div class="${avatarClass}" style="background: ${color}"><span>${initials}</span></div>`;
-                    
-                    div.innerHTML = `
-                        ${avatarHTML}
-                        <div class="content">
-                            <div class="meta">
-                                <span class="sender" style="color: ${color}">${isMe ? 'You' : name}</span>
-                                <span class="time">${time}</span>
-                            </div>
-                            <div class="text">${escapeHtml(msg.text)}</div>
-                        </div>
-                    `;
-                    
-                    messagesEl.appendChild(div);
-                    lastMessageId = msg.id;
-                });
-                
-                // Scroll to bottom
-                messagesEl.scrollTop = messagesEl.scrollHeight;
-                
-            } catch (error) {
-                console.error('Load failed:', error);
-                messagesEl.innerHTML = '<div class="empty">Connection error</div>';
-            }
-        }
-        
-        // Send message
-        async function sendMessage() {
-            const text = inputEl.value.trim();
-            if (!text) return;
-            
-            // Save original text and clear
-            const originalText = text;
-            inputEl.value = '';
-            inputEl.style.height = 'auto';
-            sendBtn.disabled = true;
-            
-            try {
-                const res = await fetch('/send', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({
-                        room: room,
-                        text: originalText,
-                        sender_id: userId
-                    })
-                });
-                
-                if (!res.ok) throw new Error('Send failed');
-                
-                // Update messages immediately
-                await updateMessages();
-                
-            } catch (error) {
-                console.error('Send failed:', error);
-                // Restore text if failed
-                inputEl.value = originalText;
-                inputEl.focus();
-            }
-            
-            sendBtn.disabled = false;
-            inputEl.focus();
-        }
-        
-        // Copy link
-        async function copyLink() {
-            try {
-                await navigator.clipboard.writeText(shareUrlEl.textContent);
-                alert('Link copied!');
-            } catch (error) {
-                alert('Failed to copy');
-            }
-        }
-        
-        // Helper functions
-        function formatTime(timestamp) {
-            const date = new Date(timestamp);
-            const now = new Date();
-            const diff = now - date;
-            
-            if (diff < 60000) return 'Just now';
-            if (diff < 3600000) return Math.floor(diff / 60000) + 'm';
-            if (diff < 86400000) return Math.floor(diff / 3600000) + 'h';
-            return date.getHours().toString().padStart(2, '0') + ':' + 
-                   date.getMinutes().toString().padStart(2, '0');
-        }
-        
-        function escapeHtml(text) {
-            const div = document.createElement('div');
-            div.textContent = text;
-            return div.innerHTML;
-        }
-        
-        // Initialize
-        loadMessages();
-        populateColorGrid();
-        populateShapeGrid();
-        
-        // Smart polling - only update when needed
-        let updateTimer = null;
-        function scheduleUpdate() {
-            if (updateTimer) clearTimeout(updateTimer);
-            updateTimer = setTimeout(async () => {
-                await updateMessages();
-                scheduleUpdate();
-            }, 1000);
+def get_room_lock(room):
+    """Get or create the lock guarding a room's message list"""
+    lock = room_locks.get(room)
+    if lock is None:
+        with room_locks_guard:
+            lock = room_locks.setdefault(room, threading.Lock())
+    return lock
+
+def record_change(entry):
+    """Add a change to the replication log and wake followers"""
+    global replication_head
+    with replication_changed:
+        replication_head += 1
+        replication_log.append((replication_head, entry))
+        replication_changed.notify_all()
+
+def apply_change(entry, replayed=False):
+    """Apply a change made on another node (replication, where appends are
+    `replayed` as they were, or pub/sub)"""
+    global profile_version
+    kind = entry['type']
+    if kind == 'append':
+        # Skip anything a snapshot already brought in
+        known = message_seqs.get(entry['room'], {})
+        new = [message for message in entry['messages'] if message['id'] not in known]
+        if new:
+            append_messages(entry['room'], new, publish=False, replayed=replayed)
+    elif kind == 'import':
+        import_room(entry['room'], entry['messages'], entry.get('reactors'))
+    elif kind == 'profile':
+        user_info[entry['user_id']] = entry['profile']
+        profile_version += 1
+        record_change(entry)
+    elif kind == 'retention':
+        set_retention(entry['room'], entry['policy'])
+
+def notify_room(room):
+    """Bump the room version and wake anyone waiting for new messages"""
+    global global_version
+    with new_messages:
+        room_versions[room] = room_versions.get(room, 0) + 1
+        global_version += 1
+        recent_changes.append((global_version, room))
+        new_messages.notify_all()
+
+def fan_out(room, new):
+    """Hand new messages to the room's /stream subscribers"""
+    subscribers = stream_subscribers.get(room)
+    if subscribers:
+        for subscriber in list(subscribers):
+            subscriber.offer(new)
+
+def notify_presence(rooms):
+    """Wake long-polls watching `rooms` because their presence changed"""
+    global global_version
+    if not rooms:
+        return
+    with new_messages:
+        for room in rooms:
+            global_version += 1
+            recent_changes.append((global_version, room))
+        new_messages.notify_all()
+
+def changed_rooms(version):
+    """Rooms changed after global `version`, or None if the log no longer
+    reaches back that far. Call with new_messages held."""
+    changed = set()
+    for change_version, room in reversed(recent_changes):
+        if change_version <= version:
+            return changed
+        changed.add(room)
+    if recent_changes and recent_changes[0][0] > version + 1:
+        return None
+    return changed
+
+def mark_phase(name):
+    """Close the current request's running phase as `name` (no-op unless tracing)"""
+    if TRACING and has_request_context():
+        now = time.perf_counter()
+        g.phases.append((name, now - g.phase_started))
+        g.phase_started = now
+
+def message_size(message):
+    """Approximate memory held by one message dict, in bytes"""
+    return sys.getsizeof(message) + sum(sys.getsizeof(value) for value in message.values())
+
+def with_profile(msg):
+    """In live profiles mode, the message with its sender's current profile"""
+    if LIVE_PROFILES:
+        profile = user_info.get(msg.get('sender_id'))
+        if profile:
+            return dict(msg,
+                        sender_color=profile['color'],
+                        sender_name=profile['name'],
+                        sender_shape=profile['shape'])
+    return msg
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+def add_posting(room, token, seq, count):
+    """Record that message `seq` has `count` of `token`. Call with the room lock held."""
+    posting = search_index.setdefault(room, {}).setdefault(token, {})
+    if seq in posting:
+        remove_posting(room, token, seq)
+        posting = search_index[room].setdefault(token, {})
+    posting[seq] = count
+    buckets = search_impacts.setdefault(room, {}).setdefault(token, {})
+    bucket = buckets.get(count)
+    if bucket is None:
+        bucket = buckets[count] = SortedSeqs()
+    bucket.add(seq)
+
+def remove_posting(room, token, seq):
+    """Forget `token` for message `seq`. Call with the room lock held."""
+    index = search_index.get(room, {})
+    posting = index.get(token)
+    count = posting.pop(seq, None) if posting is not None else None
+    if count is None:
+        return
+    if not posting:
+        del index[token]
+    impacts = search_impacts[room][token]
+    bucket = impacts[count]
+    bucket.remove(seq)
+    if not bucket:
+        del impacts[count]
+        if not impacts:
+            del search_impacts[room][token]
+
+def index_messages(room, new):
+    """Add messages to the room's search index (skipping any already
+    trimmed out of the history). Call with the room lock held."""
+    docs = search_docs.setdefault(room, {})
+    floor = search_floor.get(room, 1)
+    for message in new:
+        if message.get('type') or message.get('deleted') or message['seq'] < floor:
+            continue
+        counts = Counter(tokenize(message['text']))
+        if not counts:
+            continue
+        seq = message['seq']
+        docs[seq] = message
+        for token, count in counts.items():
+            add_posting(room, token, seq, count)
+    
+    trim_search(room)
+
+def trim_search(room, before_ts=None):
+    """Drop the oldest documents (and their postings) past the history
+    limit, or with ts <= `before_ts`. Call with the room lock held."""
+    docs = search_docs.get(room, {})
+    floor = search_floor.get(room, 1)
+    last = room_seqs.get(room, 0)
+    while docs and floor <= last:
+        oldest = docs.get(floor)
+        if oldest is not None:
+            if len(docs) <= SEARCH_HISTORY and (before_ts is None or oldest['ts'] > before_ts):
+                break
+            del docs[floor]
+            for token in set(tokenize(oldest['text'])):
+                remove_posting(room, token, floor)
+        floor += 1
+    search_floor[room] = floor
+
+def ensure_indexed(room):
+    """Index messages restored from a snapshot. Call with the room lock held."""
+    pending = search_pending.pop(room, None)
+    if pending:
+        search_floor.setdefault(room, pending[0]['seq'])
+        index_messages(room, pending)
+
+def impact_order(buckets, below=None):
+    """(count, seq) for each document of a token, from its search_impacts
+    `buckets`: highest term count first, newest first within a count, and
+    only those under `below` (a (count, seq) pair) when given"""
+    for count in sorted(buckets, reverse=True):
+        if below is not None and count > below[0]:
+            continue
+        bucket = buckets.get(count)
+        if bucket is None:
+            continue
+        seqs = bucket.seqs
+        index = len(seqs)
+        if below is not None and count == below[0]:
+            index = bisect.bisect_left(seqs, below[1], bucket.start)
+        while index > bucket.start:
+            index -= 1
+            if index < len(seqs):
+                yield count, seqs[index]
+
+def search_room(room, query, limit, cursor=None):
+    """Rank the room's messages containing every query token.
+
+    Scores are tf-idf, ties broken by recency. `cursor` is the "score:seq"
+    of the last result of the previous page. Returns (results, next_cursor).
+    """
+    tokens = set(tokenize(query))
+    if room in search_pending:
+        with get_room_lock(room):
+            ensure_indexed(room)
+    index = search_index.get(room, {})
+    docs = search_docs.get(room, {})
+    if not tokens or not docs:
+        return [], None
+    
+    postings = []
+    for token in tokens:
+        posting = index.get(token)
+        if not posting:
+            return [], None
+        postings.append((token, posting))
+    
+    total = len(docs)
+    weights = {token: math.log(1 + total / len(posting)) for token, posting in postings}
+    
+    after = None
+    if cursor:
+        score, _, seq = cursor.partition(':')
+        after = (float(score), int(seq))
+    
+    # Threshold algorithm: walk every token's documents in impact order
+    # side by side, scoring each new document in full. An unseen document
+    # scores at most the sum of the counts the walks are at (and is no newer
+    # than the oldest of their seqs), so stop once the page can't change.
+    # `top` is a heap of (score, seq) with the worst result kept first.
+    impacts = search_impacts.get(room, {})
+    walks = []
+    for token, posting in postings:
+        below = None
+        if after is not None and len(postings) == 1:
+            # One token: scores are exact, so start the walk at the cursor
+            for count in sorted(impacts.get(token, {}), reverse=True):
+                score = round(count * weights[token], 6)
+                if score <= after[0]:
+                    below = (count, after[1] if score == after[0] else math.inf)
+                    break
+            else:
+                return [], None
+        walks.append(impact_order(impacts.get(token, {}), below))
+    fronts = [next(walk, None) for walk in walks]
+    seen = set()
+    top = []
+    while all(fronts):
+        threshold = 0
+        for (token, _), (count, _) in zip(postings, fronts):
+            threshold += count * weights[token]
+        if len(top) > limit and top[0] >= (round(threshold, 6), min(seq for _, seq in fronts)):
+            break
+        for position, (count, seq) in enumerate(fronts):
+            fronts[position] = next(walks[position], None)
+            # Appends and trims don't take the search's side: skip anything
+            # stale under us
+            if seq in seen or postings[position][1].get(seq) != count:
+                continue
+            seen.add(seq)
+            score = 0
+            for token, posting in postings:
+                other = posting.get(seq)
+                if other is None:
+                    break
+                score += other * weights[token]
+            else:
+                key = (round(score, 6), seq)
+                if after is not None and key >= after:
+                    continue
+                if len(top) <= limit:
+                    heapq.heappush(top, key)
+                elif key > top[0]:
+                    heapq.heapreplace(top, key)
+    
+    top.sort(reverse=True)
+    next_cursor = None
+    if len(top) > limit:
+        top = top[:limit]
+        next_cursor = f'{top[-1][0]}:{top[-1][1]}'
+    
+    results = [dict(with_profile(docs[seq]), score=score) for score, seq in top if seq in docs]
+    return results, next_cursor
+
+def build_entry(kind, **fields):
+    """A change-log entry (e.g. an expiry) that travels through the room's
+    cursor like a message. Entries have a "type"; messages don't."""
+    return dict(fields, id=str(uuid.uuid4()), type=kind, timestamp=datetime.now().isoformat())
+
+def build_message(text, sender_id, user_data):
+    """Create a message dict stamped with the sender's current profile"""
+    if LIVE_PROFILES:
+        # Profile fields are joined in by room_view() when read
+        return {
+            'id': str(uuid.uuid4()),
+            'text': text,
+            'sender_id': sender_id,
+            'timestamp': datetime.now().isoformat()
         }
-        
-        scheduleUpdate();
-        
-        // Also update when window gets focus
-        window.addEventListener('focus', updateMessages);
-        
-        // Auto-focus input
-        inputEl.focus();
-        
-        // Close modal on overlay click
-        settingsModal.addEventListener('click', function(e) {
-            if (e.target === this) {
-                hideSettingsModal();
-            }
-        });
-    </script>
-</body>
-</html>
-'''
+    
+    return {
+        'id': str(uuid.uuid4()),
+        'text': text,
+        'sender_id': sender_id,
+        'sender_color': user_data['color'],
+        'sender_name': user_data['name'],
+        'sender_shape': user_data['shape'],  # Include shape in message
+        'timestamp': datetime.now().isoformat()
+    }
+
+def append_messages(room, new, publish=True, replayed=False):
+    """Append messages to a room under one lock, trim once and notify once.
+    
+    Unless `publish` is False the messages also go out on the pub/sub bus.
+    `replayed` messages (from the primary's change log) keep their seq and
+    ts; ValueError if the seqs don't follow on from the room's.
+    """
+    global messages_total
+    with get_room_lock(room):
+        room_messages = messages.setdefault(room, [])
+        seqs = message_seqs.setdefault(room, {})
+        seq = room_seqs.get(room, 0)
+        size = room_bytes.get(room, 0)
+        # Epoch-ms time index, kept non-decreasing so it can be bisected
+        ts = max(int(time.time() * 1000), room_messages[-1]['ts'] if room_messages else 0)
+        if replayed:
+            if [message['seq'] for message in new] != list(range(seq + 1, seq + 1 + len(new))):
+                raise ValueError(f'{room} is at seq {seq}, got seq {new[0]["seq"]}')
+            ts = new[-1]['ts']
+        for message in new:
+            seq += 1
+            if not replayed:
+                message['seq'] = seq
+                message['ts'] = ts
+            seqs[message['id']] = seq
+            size += message_size(message)
+        room_seqs[room] = seq
+        room_messages.extend(new)
+        posted = sum(1 for message in new if not message.get('type'))
+        room_counts[room] = room_counts.get(room, 0) + posted
+        room_posted[room] = room_posted.get(room, 0) + posted
+        ensure_indexed(room)
+        index_messages(room, new)
+        
+        for entry in new:
+            kind = entry.get('type')
+            if kind == 'expire':
+                room_messages, size = apply_expire(room, room_messages, size, entry)
+            elif kind in ('edit', 'delete'):
+                room_messages, size = apply_revision(room, room_messages, size, entry)
+            elif kind == 'react':
+                room_messages, size = apply_reaction(room, room_messages, size, entry)
+        record_change({'type': 'append', 'room': room, 'messages': new})
+        
+        # Trim to the room's count and size limits, then cap the entries
+        drop = trim_start(room, room_messages, room_counts[room])
+        for message in room_messages[:drop]:
+            forget_message(room, seqs, message)
+            size -= message_size(message)
+        room_messages, dropped = trim_entries(room_messages[drop:] if drop else room_messages,
+                                              room_counts[room])
+        for entry in dropped:
+            forget_message(room, seqs, entry)
+            size -= message_size(entry)
+        messages[room] = room_messages
+        room_bytes[room] = size
+        policy = retention_policy(room)
+        if policy['max_age'] and messages[room]:
+            schedule_expiry(room, messages[room][0]['ts'], policy['max_age'])
+        # Still under the lock, so concurrent sends reach streams in seq
+        # order (offer() never blocks)
+        fan_out(room, new)
+    mark_phase('append')
+    
+    with activity_lock:
+        room_activity.pop(room, None)
+        room_activity[room] = ts
+        count = room_counts.get(room)
+        if count is not None:
+            room_ranks['messages'].set(room, count)
+    with metrics_lock:
+        messages_total += len(new)
+    notify_room(room)
+    mark_phase('notify')
+    if publish and bus is not None:
+        bus_publish('room:' + room, {'type': 'append', 'messages': new})
+
+def retention_policy(room):
+    policy = dict(RETENTION_DEFAULTS, **room_retention.get(room, {}))
+    policy['max_count'] = min(policy['max_count'] or MAX_MESSAGES_PER_ROOM, MAX_MESSAGES_PER_ROOM)
+    return policy
+
+def trim_start(room, room_messages, count):
+    """How many messages to drop from the front of `room_messages`, of which
+    `count` are real messages, to fit the room's retention policy. Only
+    real messages count against max_count and max_bytes (see trim_entries)."""
+    policy = retention_policy(room)
+    drop = 0
+    while drop < len(room_messages) and count > policy['max_count']:
+        if not room_messages[drop].get('type'):
+            count -= 1
+        drop += 1
+    if policy['max_bytes']:
+        size = sum(message_size(message) for message in room_messages[drop:] if not message.get('type'))
+        while size > policy['max_bytes'] and count > 1:
+            if not room_messages[drop].get('type'):
+                size -= message_size(room_messages[drop])
+                count -= 1
+            drop += 1
+    return drop
+
+def trim_entries(room_messages, count):
+    """Split `room_messages`, of which `count` are real messages, into the
+    ones kept and the oldest change-log entries past MAX_ROOM_ENTRIES.
+    Real messages are never dropped to make room for entries."""
+    excess = len(room_messages) - count - MAX_ROOM_ENTRIES
+    if excess <= 0:
+        return room_messages, []
+    dropped = []
+    index = 0
+    while len(dropped) < excess:
+        if room_messages[index].get('type'):
+            dropped.append(room_messages[index])
+        index += 1
+    kept = [message for message in room_messages[:index] if not message.get('type')]
+    return kept + room_messages[index:], dropped
+
+def live_window(room, room_messages):
+    """The live part of a room's whole history (search history included),
+    under the room's retention policy"""
+    # No policy keeps more than this, so the trim never walks the history
+    tail = room_messages[-(MAX_MESSAGES_PER_ROOM + MAX_ROOM_ENTRIES):]
+    count = sum(1 for message in tail if not message.get('type'))
+    live = tail[trim_start(room, tail, count):]
+    return trim_entries(live, sum(1 for message in live if not message.get('type')))[0]
+
+def cursor_seqs(room_messages):
+    """id -> seq for a room's messages, including the entries they folded"""
+    seqs = {}
+    for message in room_messages:
+        seqs[message['id']] = message['seq']
+        for folded_id, folded_seq in message.get('folds', ()):
+            seqs[folded_id] = folded_seq
+    return seqs
+
+def forget_message(room, seqs, message):
+    """Drop a message leaving the room from the cursor map (with the
+    entries it folded), the room's count and the reaction sets"""
+    seqs.pop(message['id'], None)
+    if not message.get('type'):
+        room_counts[room] -= 1
+    for folded_id, _ in message.get('folds', ()):
+        seqs.pop(folded_id, None)
+    reactors = message_reactors.get(room)
+    if reactors:
+        reactors.pop(message['id'], None)
+
+def unindex_message(room, message):
+    """Remove one message from the room's search index. Call with the room lock held."""
+    seq = message['seq']
+    docs = search_docs.get(room, {})
+    if docs.pop(seq, None) is None:
+        return
+    for token in set(tokenize(message['text'])):
+        remove_posting(room, token, seq)
+
+def fold_entry(room, entry, previous):
+    """Fold the superseded entry `previous` into `entry`: its id (and the
+    ones it had folded) keeps working as a cursor, up to MAX_FOLDS. Call
+    with the room lock held; returns the change in the room's size once
+    `previous` is removed."""
+    before = message_size(entry)
+    folds = dict(entry.get('folds', ()))
+    folds.update(previous.get('folds', ()))
+    folds[previous['id']] = previous['seq']
+    if len(folds) > MAX_FOLDS:
+        ordered = sorted(folds.items(), key=lambda fold: fold[1])
+        seqs = message_seqs[room]
+        for folded_id, _ in ordered[:-MAX_FOLDS]:
+            seqs.pop(folded_id, None)
+        folds = dict(ordered[-MAX_FOLDS:])
+    entry['folds'] = [list(fold) for fold in folds.items()]
+    return message_size(entry) - before - message_size(previous)
+
+def apply_revision(room, room_messages, size, entry):
+    """Apply an "edit" or "delete" entry: the target message is replaced
+    by its new revision (or a tombstone) and reindexed, and earlier
+    entries for the same target are folded into this one. Call with the
+    room lock held; returns the new list and size."""
+    target = entry['target']
+    superseded = ('edit', 'delete', 'react') if entry['type'] == 'delete' else ('edit', 'delete')
+    kept = []
+    for message in room_messages:
+        if message is entry:
+            kept.append(message)
+        elif message['id'] == target and not message.get('type'):
+            if message.get('deleted'):
+                kept.append(message)
+                continue
+            unindex_message(room, message)
+            if entry['type'] == 'edit':
+                revised = dict(message, text=entry['text'], edited=entry['timestamp'])
+                index_messages(room, [revised])
+            else:
+                revised = {key: message[key] for key in ('id', 'seq', 'ts', 'sender_id', 'timestamp')}
+                revised['deleted'] = True
+                message_reactors.get(room, {}).pop(target, None)
+            size += message_size(revised) - message_size(message)
+            kept.append(revised)
+        elif message.get('type') in superseded and message.get('target') == target:
+            # Superseded: clients past it only need the newest revision
+            size += fold_entry(room, entry, message)
+        else:
+            kept.append(message)
+    return kept, size
+
+def apply_reaction(room, room_messages, size, entry):
+    """Apply a "react" entry: add or remove (toggle unless it says) the
+    sender's emoji on the target, store the outcome on the entry as
+    "remove" and the emoji's new absolute "count", and fold the previous
+    entry for the same target and emoji into it. Only the target's slot
+    and that entry change, never the rest of the room. Call with the room
+    lock held; returns the new list and size."""
+    target = entry['target']
+    emoji = entry['emoji']
+    entry_size = message_size(entry)
+    seq = message_seqs[room].get(target)
+    index = first_after(room_messages, seq - 1) if seq is not None else len(room_messages)
+    if index == len(room_messages) or room_messages[index]['id'] != target \
+            or room_messages[index].get('type') or room_messages[index].get('deleted'):
+        entry['count'] = 0
+        return room_messages, size + message_size(entry) - entry_size
+    
+    message = room_messages[index]
+    reactors = message_reactors.setdefault(room, {}).setdefault(target, {})
+    mine = reactors.get(entry['sender_id'], [])
+    remove = entry.get('remove', emoji in mine)
+    counts = dict(message.get('reactions', {}))
+    if remove and emoji in mine:
+        mine = [other for other in mine if other != emoji]
+        counts[emoji] -= 1
+        if not counts[emoji]:
+            del counts[emoji]
+    elif not remove and emoji not in mine and len(mine) < MAX_REACTIONS_PER_USER \
+            and (emoji in counts or len(counts) < MAX_REACTION_KINDS):
+        mine = mine + [emoji]
+        counts[emoji] = counts.get(emoji, 0) + 1
+    if mine:
+        reactors[entry['sender_id']] = mine
+    else:
+        reactors.pop(entry['sender_id'], None)
+    if not reactors:
+        del message_reactors[room][target]
+    entry['remove'] = remove
+    entry['count'] = counts.get(emoji, 0)
+    size += message_size(entry) - entry_size
+    
+    # Swap in the new counts without touching the list readers may be slicing
+    revised = dict(message, reactions=counts)
+    if not counts:
+        del revised['reactions']
+    room_messages[index] = revised
+    size += message_size(revised) - message_size(message)
+    
+    # Fold the previous entry for this emoji: the new count replaces it
+    for i in range(len(room_messages) - 1, index, -1):
+        previous = room_messages[i]
+        if previous is not entry and previous.get('type') == 'react' \
+                and previous['target'] == target and previous['emoji'] == emoji:
+            size += fold_entry(room, entry, previous)
+            room_messages = room_messages[:i] + room_messages[i + 1:]
+            break
+    return room_messages, size
+
+def apply_expire(room, room_messages, size, entry):
+    """Remove the messages an "expire" entry names, and search history up
+    to its cutoff. Call with the room lock held; returns the new list and size."""
+    ensure_indexed(room)
+    expired = set(entry['ids'])
+    seqs = message_seqs.get(room, {})
+    kept = []
+    for message in room_messages:
+        if message['id'] in expired:
+            forget_message(room, seqs, message)
+            size -= message_size(message)
+        else:
+            kept.append(message)
+    trim_search(room, before_ts=entry['before'])
+    return kept, size
+
+def schedule_expiry(room, oldest_ts, max_age):
+    """Make sure the sweeper visits `room` when its oldest message expires"""
+    global retention_sweeper
+    with retention_lock:
+        if room in retention_scheduled:
+            return
+        retention_scheduled.add(room)
+        heapq.heappush(retention_heap, (oldest_ts + int(max_age * 1000), room))
+        if retention_sweeper is None:
+            retention_sweeper = threading.Thread(target=sweep_retention, daemon=True)
+            retention_sweeper.start()
+
+def expire_room(room):
+    """Expire the room's messages older than its max_age. Returns the ts of
+    the oldest message left, or None."""
+    max_age = retention_policy(room)['max_age']
+    if not max_age:
+        return None
+    cutoff = int(time.time() * 1000) - int(max_age * 1000)
+    with get_room_lock(room):
+        room_messages = messages.get(room, [])
+        due = []
+        for message in room_messages:
+            if message['ts'] > cutoff:
+                break
+            due.append(message)
+    
+    if any(not message.get('type') for message in due):
+        append_messages(room, [build_entry('expire', ids=[message['id'] for message in due], before=cutoff)])
+    elif due:
+        # Only old entries left to drop; nobody needs telling
+        with get_room_lock(room):
+            kept, room_bytes[room] = apply_expire(room, messages.get(room, []), room_bytes.get(room, 0),
+                                                  {'ids': [message['id'] for message in due], 'before': cutoff})
+            messages[room] = kept
+        notify_room(room)
+    
+    room_messages = messages.get(room)
+    return room_messages[0]['ts'] if room_messages else None
+
+def sweep_retention():
+    """Expire rooms as their oldest message comes due (replicas wait for
+    the primary's expire entries instead)"""
+    while True:
+        time.sleep(1)
+        now = int(time.time() * 1000)
+        due = []
+        with retention_lock:
+            while retention_heap and retention_heap[0][0] <= now:
+                room = heapq.heappop(retention_heap)[1]
+                retention_scheduled.discard(room)
+                due.append(room)
+        for room in due:
+            if replica_of is not None:
+                continue
+            try:
+                oldest = expire_room(room)
+            except Exception:
+                app.logger.exception('Expiring %s failed', room)
+                continue
+            max_age = retention_policy(room)['max_age']
+            if oldest is not None and max_age:
+                schedule_expiry(room, oldest, max_age)
+
+def expire_presence():
+    """Drop users whose heartbeat ran out. Call with activity_lock held;
+    returns the rooms whose presence changed."""
+    changed = set()
+    for room, user in presence_wheel.expire():
+        present = room_presence.get(room)
+        if present is not None and present.pop(user, None) is not None:
+            presence_versions[room] = presence_versions.get(room, 0) + 1
+            changed.add(room)
+            if present:
+                room_ranks['readers'].set(room, len(present))
+            else:
+                del room_presence[room]
+                room_ranks['readers'].discard(room)
+    return changed
+
+def sweep_presence():
+    """Expire presence once a second so long-polls hear about leavers"""
+    while True:
+        time.sleep(1)
+        with activity_lock:
+            changed = expire_presence()
+        notify_presence(changed)
+
+def heartbeat(rooms, user, typing=(), ttl=None):
+    """Mark `user` present in `rooms` (and typing in the `typing` rooms)"""
+    global presence_sweeper
+    if not user:
+        return
+    if ttl is None:
+        ttl = PRESENCE_TTL
+    with activity_lock:
+        if presence_sweeper is None:
+            presence_sweeper = threading.Thread(target=sweep_presence, daemon=True)
+            presence_sweeper.start()
+        changed = expire_presence()
+        for room in rooms:
+            is_typing = room in typing
+            present = room_presence.setdefault(room, {})
+            if present.get(user) is not is_typing:
+                present[user] = is_typing
+                presence_versions[room] = presence_versions.get(room, 0) + 1
+                changed.add(room)
+                room_ranks['readers'].set(room, len(present))
+            presence_wheel.touch((room, user), ttl)
+    notify_presence(changed)
+
+def count_readers(room):
+    """Users currently present in `room`"""
+    with activity_lock:
+        changed = expire_presence()
+        count = len(room_presence.get(room, ()))
+    notify_presence(changed)
+    return count
+
+def presence_since(rooms, known):
+    """Presence of each room in `rooms` whose version differs from the
+    client's `known` {room: version}"""
+    with activity_lock:
+        changed = expire_presence()
+        updates = {}
+        for room in rooms:
+            version = presence_versions.get(room, 0)
+            if known.get(room) == version:
+                continue
+            users = []
+            for user, is_typing in room_presence.get(room, {}).items():
+                profile = user_info.get(user, {})
+                users.append({
+                    'id': user,
+                    'name': profile.get('name', 'User'),
+                    'color': profile.get('color'),
+                    'typing': is_typing,
+                })
+            updates[room] = {'version': version, 'users': users}
+    notify_presence(changed)
+    return updates
+
+def room_summary(room):
+    return {
+        'room': room,
+        'messages': room_counts.get(room, 0),
+        'last_activity': room_activity.get(room),
+        'readers': count_readers(room),
+    }
+
+def first_after(room_messages, value, key='seq'):
+    """Index of the first message whose `key` (seq or ts) is above `value`"""
+    lo, hi = 0, len(room_messages)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if room_messages[mid][key] <= value:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def room_view(room, serialized=False):
+    """The room's messages as served to clients (or their JSON when
+    `serialized`), memoized per (room version, profile version)"""
+    # Read the versions before the data so a racing write can only make
+    # the cached entry newer than its key, never older
+    key = (room_versions.get(room, 0), profile_version if LIVE_PROFILES else None)
+    cached = room_views.get(room)
+    if cached is None or cached[0] != key:
+        room_messages = messages.get(room, [])
+        if LIVE_PROFILES:
+            room_messages = [with_profile(msg) for msg in room_messages]
+        cached = room_views[room] = [key, room_messages, None]
+    
+    if not serialized:
+        return cached[1]
+    if cached[2] is None:
+        cached[2] = json.dumps(cached[1])
+    return cached[2]
+
+def messages_since(room, since):
+    """Return the messages posted in `room` after the message with id `since`.
+
+    Falls back to the whole room when the cursor is empty or no longer
+    present (e.g. it was trimmed away).
+    """
+    room_messages = room_view(room)
+    if since:
+        seq = message_seqs.get(room, {}).get(since)
+        if seq is not None:
+            index = first_after(room_messages, seq)
+            mark_phase('cursor')
+            new = room_messages[index:]
+            mark_phase('slice')
+            return new
+    return room_messages
+
+def record_read(room, user, since):
+    """Advance `user`'s read position in `room` to the message `since`"""
+    if not user or not since:
+        return
+    seq = message_seqs.get(room, {}).get(since)
+    if seq is None:
+        return
+    # Messages posted up to `since`: the total minus the real ones after it
+    posted = room_posted.get(room, 0)
+    posted -= sum(1 for message in messages_since(room, since) if not message.get('type'))
+    with receipts_lock:
+        reads = user_reads.setdefault(user, {})
+        previous = reads.get(room)
+        if previous is not None and previous[0] >= seq:
+            return
+        reads[room] = (seq, posted)
+        positions = read_positions.setdefault(room, [])
+        if previous is not None:
+            del positions[bisect.bisect_left(positions, previous[0])]
+        bisect.insort(positions, seq)
+
+def unread_counts(user):
+    """{room: messages posted since the user's read position}"""
+    with receipts_lock:
+        reads = dict(user_reads.get(user, {}))
+    return {room: max(room_posted.get(room, 0) - posted, 0) for room, (seq, posted) in reads.items()}
+
+def seen_by(room, seq):
+    """How many users have read up to (at least) message `seq`"""
+    with receipts_lock:
+        positions = read_positions.get(room, [])
+        return len(positions) - bisect.bisect_left(positions, seq)
+
+def parse_time(value):
+    """Epoch milliseconds from an epoch-ms number or an ISO date/time"""
+    try:
+        return int(float(value))
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+
+def messages_between(room, start, end, limit):
+    """Up to `limit` messages with start <= ts <= end, oldest first"""
+    room_messages = room_view(room)
+    lo = first_after(room_messages, start - 1, key='ts') if start is not None else 0
+    hi = first_after(room_messages, end, key='ts') if end is not None else len(room_messages)
+    return room_messages[lo:min(hi, lo + limit)]
+
+def collect_updates(cursors, rooms):
+    """Map each room in `rooms` with messages past its cursor to those messages"""
+    updates = {}
+    for room in rooms:
+        room_messages = messages.get(room)
+        since = cursors.get(room)
+        # Cheap check first: nothing new if the cursor is the last message
+        if not room_messages or (since and room_messages[-1]['id'] == since):
+            continue
+        new = messages_since(room, since)
+        if new:
+            updates[room] = new
+    return updates
 
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    theme = request.args.get('theme', DEFAULT_THEME)
+    page = PAGES.get(theme) or PAGES[DEFAULT_THEME]
+    return app.response_class(page, mimetype='text/html')
 
 @app.route('/send', methods=['POST'])
 def send_message():
@@ -1094,38 +1408,201 @@ def send_message():
         room = data.get('room', 'main')
         text = data.get('text', '').strip()
         sender_id = data.get('sender_id', 'anonymous')
+        # Optional cursor: when present, reply with everything after it
+        has_cursor = 'since' in data
+        since = data.get('since')
         
         if not text:
             return jsonify({'error': 'No message text'}), 400
+        mark_phase('parse')
         
-        if room not in messages:
-            messages[room] = []
+        limited = rate_limit(send_limiter, client_key(data.get('sender_id'))) or \
+            rate_limit(room_send_limiter, room)
+        if limited:
+            return limited
+        watch_room(room)
         
         # Get user info - this will create it if it doesn't exist
         user_data = get_user_info(sender_id)
+        mark_phase('user')
         
-        message = {
-            'id': str(uuid.uuid4()),
-            'text': text,
-            'sender_id': sender_id,
-            'sender_color': user_data['color'],
-            'sender_name': user_data['name'],
-            'sender_shape': user_data['shape'],  # Include shape in message
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        messages[room].append(message)
+        message = build_message(text, sender_id, user_data)
+        mark_phase('build')
+        append_messages(room, [message])
         
-        # Keep only last 200 messages
-        if len(messages[room]) > 200:
-            messages[room] = messages[room][-200:]
+        if has_cursor:
+            # Saves the client a follow-up /messages?since= round-trip
+            response = jsonify({'success': True, 'messages': messages_since(room, since)})
+            mark_phase('serialize')
+            return response
         
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/send/batch', methods=['POST'])
+def send_batch():
+    """Post many messages at once (for bots and bridges).
+
+    Accepts {"messages": [{"room", "text", "sender_id"}, ...]}; top-level
+    "room" and "sender_id" act as defaults for every item. The whole batch
+    is validated before anything is stored.
+    """
+    try:
+        data = request.json
+        if isinstance(data, list):
+            data = {'messages': data}
+        items = data.get('messages')
+        default_room = data.get('room', 'main')
+        default_sender = data.get('sender_id', 'anonymous')
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'No messages'}), 400
+        
+        if len(items) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'Too many messages (max {MAX_BATCH_SIZE})'}), 400
+        
+        # Validate everything and group by room in one pass
+        by_room = {}
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                return jsonify({'error': 'Invalid message', 'index': index}), 400
+            
+            text = item.get('text') or ''
+            room = item.get('room', default_room)
+            sender_id = item.get('sender_id', default_sender)
+            if not all(isinstance(value, str) for value in (text, room, sender_id)):
+                return jsonify({'error': 'Invalid message', 'index': index}), 400
+            
+            text = text.strip()
+            if not text:
+                return jsonify({'error': 'No message text', 'index': index}), 400
+            
+            by_room.setdefault(room, []).append((text, sender_id))
+        
+        # A batch costs one token per request and one per room touched
+        limited = rate_limit(send_limiter, client_key(data.get('sender_id')))
+        for room in by_room:
+            limited = limited or rate_limit(room_send_limiter, room)
+        if limited:
+            return limited
+        
+        # Only now create profiles, so a rejected batch leaves no trace
+        senders = {}
+        for room, room_items in by_room.items():
+            room_batch = []
+            for text, sender_id in room_items:
+                if sender_id not in senders:
+                    senders[sender_id] = get_user_info(sender_id)
+                room_batch.append(build_message(text, sender_id, senders[sender_id]))
+            by_room[room] = room_batch
+        
+        # One lock acquisition, trim and notification per room
+        ids = {}
+        for room, room_batch in by_room.items():
+            append_messages(room, room_batch)
+            ids[room] = [msg['id'] for msg in room_batch]
+        
+        return jsonify({'success': True, 'sent': len(items), 'ids': ids})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def find_message(room, message_id):
+    """The message `message_id` if it's still in the room (not an entry)"""
+    seq = message_seqs.get(room, {}).get(message_id)
+    if seq is None:
+        return None
+    room_messages = messages.get(room, [])
+    index = first_after(room_messages, seq - 1)
+    if index < len(room_messages) and room_messages[index]['id'] == message_id \
+            and not room_messages[index].get('type'):
+        return room_messages[index]
+    return None
+
+def revise_message(kind):
+    """Post an "edit" or "delete" entry for a message its sender owns"""
+    data = request.json
+    room = data.get('room', 'main')
+    message_id = data.get('id')
+    sender_id = data.get('sender_id', 'anonymous')
+    text = (data.get('text') or '').strip()
+    
+    if kind == 'edit' and not text:
+        return jsonify({'error': 'No message text'}), 400
+    
+    message = find_message(room, message_id)
+    if message is None or message.get('deleted'):
+        return jsonify({'error': 'Unknown message'}), 404
+    if message['sender_id'] != sender_id:
+        return jsonify({'error': 'Not your message'}), 403
+    
+    limited = rate_limit(send_limiter, client_key(data.get('sender_id')))
+    if limited:
+        return limited
+    
+    fields = {'text': text} if kind == 'edit' else {}
+    entry = build_entry(kind, target=message_id, sender_id=sender_id, **fields)
+    append_messages(room, [entry])
+    return jsonify({'success': True, 'id': entry['id']})
+
+@app.route('/edit', methods=['POST'])
+def edit_message():
+    """Change a message's text: {"room", "id", "text", "sender_id"}.
+    Readers get an "edit" entry through their cursor."""
+    try:
+        return revise_message('edit')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/delete', methods=['POST'])
+def delete_message():
+    """Delete a message: {"room", "id", "sender_id"}. It becomes a
+    tombstone and readers get a "delete" entry through their cursor."""
+    try:
+        return revise_message('delete')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/react', methods=['POST'])
+def react():
+    """Toggle an emoji reaction: {"room", "id", "emoji", "sender_id"}, plus
+    "remove": true/false to force a direction. Readers get a "react" entry
+    with the emoji's new count through their cursor."""
+    try:
+        data = request.json
+        room = data.get('room', 'main')
+        message_id = data.get('id')
+        sender_id = data.get('sender_id', 'anonymous')
+        emoji = data.get('emoji')
+        
+        if not isinstance(emoji, str) or not emoji.strip() or len(emoji) > MAX_EMOJI_LENGTH:
+            return jsonify({'error': 'Bad emoji'}), 400
+        
+        message = find_message(room, message_id)
+        if message is None or message.get('deleted'):
+            return jsonify({'error': 'Unknown message'}), 404
+        
+        mine = message_reactors.get(room, {}).get(message_id, {}).get(sender_id, [])
+        remove = data.get('remove', emoji in mine)
+        if not remove and emoji not in mine:
+            if len(mine) >= MAX_REACTIONS_PER_USER:
+                return jsonify({'error': f'At most {MAX_REACTIONS_PER_USER} reactions per message'}), 400
+            if emoji not in message.get('reactions', {}) and len(message.get('reactions', {})) >= MAX_REACTION_KINDS:
+                return jsonify({'error': 'Too many different reactions'}), 400
+        
+        limited = rate_limit(send_limiter, client_key(data.get('sender_id')))
+        if limited:
+            return limited
+        
+        entry = build_entry('react', target=message_id, emoji=emoji, sender_id=sender_id, remove=bool(remove))
+        append_messages(room, [entry])
+        return jsonify({'success': True, 'id': entry['id'], 'count': entry['count']})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/user', methods=['POST'])
 def update_user():
+    global profile_version
     try:
         data = request.json
         user_id = data.get('user_id')
@@ -1144,6 +1621,8 @@ def update_user():
         if shape and shape not in AVATAR_SHAPES:
             return jsonify({'error': 'Invalid shape'}), 400
         
+        previous = dict(user_info.get(user_id, {}))
+        
         # Get existing user info or create new
         if user_id in user_info:
             if name:
@@ -1167,6 +1646,15 @@ def update_user():
                 'shape': shape
             }
         
+        # Any profile change invalidates the joined room views (bumped
+        # after the write so a reader never caches old data under the new version)
+        if user_info[user_id] != previous:
+            profile_version += 1
+            record_change({'type': 'profile', 'user_id': user_id, 'profile': user_info[user_id]})
+            if cluster_ring is not None and not is_forwarded():
+                share_profile(user_id, user_info[user_id])
+            bus_publish('profiles', {'type': 'profile', 'user_id': user_id, 'profile': user_info[user_id]})
+        
         return jsonify({'success': True, 'user_info': user_info[user_id]})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1176,23 +1664,1331 @@ def get_messages():
     room = request.args.get('room', 'main')
     since = request.args.get('since', None)
     
-    room_messages = messages.get(room, [])
+    limited = rate_limit(poll_limiter, client_key(request.args.get('user')))
+    if limited:
+        return limited
+    watch_room(room)
+    heartbeat([room], request.args.get('user'), [room] if request.args.get('typing') == '1' else ())
+    record_read(room, request.args.get('user'), since)
+    
+    # Time range (e.g. jump to date): ?from=&to= as epoch ms or ISO dates
+    if 'from' in request.args or 'to' in request.args:
+        try:
+            start = parse_time(request.args['from']) if request.args.get('from') else None
+            end = parse_time(request.args['to']) if request.args.get('to') else None
+            limit = max(int(request.args.get('limit', MAX_MESSAGES_PER_ROOM)), 1)
+        except (ValueError, OverflowError):
+            return jsonify({'error': 'Invalid from, to or limit'}), 400
+        return jsonify(messages_between(room, start, end, limit))
     
     # If since parameter provided, return only newer messages
+    if since and since in message_seqs.get(room, {}):
+        new = messages_since(room, since)
+        record_poll(bool(new))
+        response = jsonify(new)
+        mark_phase('serialize')
+        return response
+    
+    # Whole room: serve the memoized JSON
+    record_poll(bool(messages.get(room)))
+    body = room_view(room, serialized=True)
+    mark_phase('serialize')
+    return app.response_class(body, mimetype='application/json')
+
+@app.route('/poll', methods=['POST'])
+def poll():
+    """Fetch new messages for many rooms in one request.
+
+    Accepts {"cursors": {room: last_seen_id_or_null, ...}, "wait": seconds}
+    and returns {"rooms": {room: [messages]}} for rooms with news only.
+    With "wait", blocks until something arrives or the timeout passes.
+    
+    Optional presence: "user" marks the caller present in every polled room
+    ("typing": [rooms] while they type), and "presence": {room: version}
+    adds {"presence": {room: {"version", "users"}}} for rooms whose
+    presence changed since that version.
+    """
+    try:
+        data = request.json or {}
+        cursors = data.get('cursors')
+        
+        if not isinstance(cursors, dict) or not cursors:
+            return jsonify({'error': 'No cursors'}), 400
+        
+        if len(cursors) > MAX_POLL_ROOMS:
+            return jsonify({'error': f'Too many rooms (max {MAX_POLL_ROOMS})'}), 400
+        
+        limited = rate_limit(poll_limiter, client_key(data.get('user')))
+        if limited:
+            return limited
+        
+        wait = min(max(float(data.get('wait') or 0), 0), MAX_POLL_WAIT)
+        known_presence = data.get('presence')
+        if not isinstance(known_presence, dict):
+            known_presence = None
+        
+        typing = data.get('typing')
+        if not isinstance(typing, list):
+            typing = ()
+        
+        # Stay present for the whole wait, not just the usual TTL
+        heartbeat(cursors, data.get('user'), typing, PRESENCE_TTL + math.ceil(wait))
+        for room, since in cursors.items():
+            watch_room(room)
+            record_read(room, data.get('user'), since)
+        
+        with new_messages:
+            version = global_version
+        updates = collect_updates(cursors, cursors)
+        presence = presence_since(cursors, known_presence) if known_presence is not None else {}
+        
+        deadline = time.monotonic() + wait
+        while not updates and not presence and not shutting_down:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            with new_messages:
+                if global_version == version and not shutting_down:
+                    new_messages.wait(remaining)
+                changed = changed_rooms(version)
+                version = global_version
+            # Only re-check subscribed rooms that changed while we slept
+            rooms = cursors if changed is None else [room for room in changed if room in cursors]
+            updates = collect_updates(cursors, rooms)
+            if known_presence is not None:
+                presence = presence_since(rooms, known_presence)
+        
+        record_poll(bool(updates))
+        reply = {'rooms': updates}
+        if known_presence is not None:
+            reply['presence'] = presence
+        if shutting_down:
+            # Poll again (the load balancer will pick another server)
+            reply['reconnect'] = True
+        return jsonify(reply)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/stream')
+def stream():
+    """Server-Sent Events for ?room=, starting after ?since=<id> (or now).
+
+    Events: "messages" (a JSON list), "resync" ({"since": last delivered
+    id}: the cursor is gone, refetch the room and dedupe by id),
+    "reconnect" and "disconnect". ?policy=resync|coalesce|disconnect picks
+    what happens when this client falls STREAM_QUEUE_LIMIT batches behind;
+    after a resync drop the stream catches up from the room itself.
+    """
+    room = request.args.get('room', 'main')
+    since = request.args.get('since') or None
+    policy = request.args.get('policy', STREAM_POLICY)
+    if policy not in STREAM_POLICIES:
+        return jsonify({'error': 'Invalid policy'}), 400
+    
+    limited = rate_limit(poll_limiter, client_key(request.args.get('user')))
+    if limited:
+        return limited
+    watch_room(room)
+    
+    subscriber = Subscriber(room, policy, request.environ.get('werkzeug.socket'))
+    # Subscribe before reading the backlog so nothing falls in between;
+    # anything in both is skipped by seq below
+    with stream_lock:
+        stream_subscribers.setdefault(room, set()).add(subscriber)
+    backlog = []
+    resync = False
     if since:
+        if since in message_seqs.get(room, {}):
+            backlog = messages_since(room, since)
+        else:
+            resync = True
+    
+    def event(name, data):
+        return f'event: {name}\ndata: {json.dumps(data)}\n\n'
+    
+    def events():
+        last_seq = message_seqs.get(room, {}).get(since, 0)
+        last_id = since
         try:
-            index = next(i for i, msg in enumerate(room_messages) if msg['id'] == since)
-            return jsonify(room_messages[index + 1:])
-        except (StopIteration, ValueError):
-            pass
+            if resync:
+                yield event('resync', {'since': last_id})
+            kind, batch = ('batch', backlog) if backlog else (None, None)
+            while True:
+                if kind == 'closed':
+                    yield event('reconnect' if batch == 'shutdown' else 'disconnect', {'reason': batch})
+                    return
+                if kind == 'resync':
+                    # Catch up from the store rather than the dropped queue
+                    if last_id in message_seqs.get(room, {}):
+                        kind, batch = 'batch', messages_since(room, last_id)
+                    else:
+                        yield event('resync', {'since': last_id})
+                if kind == 'batch':
+                    new = [with_profile(message) for message in batch if message['seq'] > last_seq]
+                    if new:
+                        last_seq = new[-1]['seq']
+                        last_id = new[-1]['id']
+                        yield event('messages', new)
+                elif kind is None:
+                    yield ': keepalive\n\n'
+                if shutting_down:
+                    kind, batch = 'closed', 'shutdown'
+                else:
+                    kind, batch = subscriber.next(STREAM_KEEPALIVE)
+        finally:
+            with stream_lock:
+                subscribers = stream_subscribers.get(room)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del stream_subscribers[room]
     
-    return jsonify(room_messages)
+    return app.response_class(events(), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-if __name__ == '__main__':
+@app.route('/rooms')
+def list_rooms():
+    """Room directory for operators: /rooms?sort=activity|messages|readers&offset=0&limit=50
+
+    Admin only, since room names are the only thing keeping rooms private.
+    """
+    require_admin()
+    sort = request.args.get('sort', 'activity')
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', 50)), 1), MAX_ROOMS_PAGE)
+    except ValueError:
+        return jsonify({'error': 'Invalid offset or limit'}), 400
+    
+    if sort != 'activity' and sort not in room_ranks:
+        return jsonify({'error': 'Invalid sort'}), 400
+    
+    changed = set()
+    with activity_lock:
+        if sort == 'activity':
+            # Already ordered by activity: walk from the most recent end
+            total = len(room_activity)
+            page = []
+            for index, room in enumerate(reversed(room_activity)):
+                if index >= offset + limit:
+                    break
+                if index >= offset:
+                    page.append(room)
+        else:
+            if sort == 'readers':
+                changed = expire_presence()
+            total = len(room_ranks[sort])
+            page = room_ranks[sort].top(offset, limit)
+    notify_presence(changed)
+    
+    return jsonify({'rooms': [room_summary(room) for room in page], 'total': total})
+
+@app.route('/unread')
+def unread():
+    """Unread message counts per room for ?user=, from their poll cursors"""
+    user = request.args.get('user')
+    if not user:
+        return jsonify({'error': 'No user ID'}), 400
+    return jsonify(unread_counts(user))
+
+@app.route('/seen')
+def seen():
+    """How many users have read ?room= up to message ?id="""
+    room = request.args.get('room', 'main')
+    seq = message_seqs.get(room, {}).get(request.args.get('id'))
+    if seq is None:
+        return jsonify({'error': 'Unknown message'}), 404
+    return jsonify({'id': request.args.get('id'), 'seen_by': seen_by(room, seq)})
+
+@app.route('/search')
+def search():
+    """Ranked full-text search over a room's history.
+
+    /search?room=main&q=words&limit=20&cursor=<next_cursor from last page>
+    """
+    room = request.args.get('room', 'main')
+    query = request.args.get('q', '').strip()
+    cursor = request.args.get('cursor') or None
+    
+    if not query:
+        return jsonify({'error': 'No query'}), 400
+    
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), MAX_SEARCH_RESULTS)
+        results, next_cursor = search_room(room, query, limit, cursor)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    
+    return jsonify({'results': results, 'next_cursor': next_cursor})
+
+def set_retention(room, policy):
+    """Replace the room's overrides of RETENTION_DEFAULTS ({} for none)"""
+    if policy:
+        room_retention[room] = policy
+    else:
+        room_retention.pop(room, None)
+    record_change({'type': 'retention', 'room': room, 'policy': policy})
+    with get_room_lock(room):
+        room_messages = messages.get(room)
+        oldest = room_messages[0]['ts'] if room_messages else None
+    max_age = retention_policy(room)['max_age']
+    if oldest is not None and max_age:
+        # The new limit may come due sooner than anything queued
+        with retention_lock:
+            retention_scheduled.discard(room)
+        schedule_expiry(room, oldest, max_age)
+
+@app.route('/retention', methods=['GET', 'POST'])
+def retention():
+    """A room's retention policy. POST {"room", "max_age" (seconds),
+    "max_count", "max_bytes"} sets it (admin only); null or a missing key
+    means the server default. Count and size apply from the next message."""
+    if request.method == 'GET':
+        return jsonify(retention_policy(request.args.get('room', 'main')))
+    
+    require_admin()
+    data = request.get_json(silent=True) or {}
+    room = data.get('room', 'main')
+    policy = {}
+    for key in ('max_age', 'max_count', 'max_bytes'):
+        value = data.get(key)
+        if value is None:
+            continue
+        # Counts and sizes are whole numbers; bools are ints to Python but not here
+        kinds = (int, float) if key == 'max_age' else int
+        if not isinstance(value, kinds) or isinstance(value, bool) or not math.isfinite(value) or value < 0:
+            return jsonify({'error': f'Invalid {key}'}), 400
+        policy[key] = value
+    set_retention(room, policy)
+    return jsonify(retention_policy(room))
+
+def client_key(sender_id=None):
+    """Rate-limit key for the current request: its user/sender id, else its IP"""
+    return sender_id or request.remote_addr
+
+def rate_limit(limiter, key, cost=1):
+    """None if allowed, otherwise a 429 response with Retry-After"""
+    wait = limiter.take(key, cost)
+    if not wait:
+        return None
+    response = jsonify({'error': 'Too many requests', 'retry_after': round(wait, 2)})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(math.ceil(wait))
+    return response
+
+def record_poll(hit):
+    """Count a read as a hit (returned messages) or a miss (empty)"""
+    with metrics_lock:
+        poll_results['hit' if hit else 'miss'] += 1
+
+@app.before_request
+def start_timer():
+    g.request_started = g.phase_started = time.perf_counter()
+    g.phases = []
+
+@app.before_request
+def track_inflight():
+    """Count requests being served; once shutting down, turn new ones away"""
+    global inflight_requests
+    with inflight_changed:
+        if not shutting_down:
+            inflight_requests += 1
+            g.inflight = True
+            return None
+    response = jsonify({'error': 'Server is shutting down', 'reconnect': True})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    response.headers['Connection'] = 'close'
+    return response
+
+@app.teardown_request
+def untrack_inflight(exc):
+    global inflight_requests
+    if g.get('inflight'):
+        with inflight_changed:
+            inflight_requests -= 1
+            inflight_changed.notify_all()
+
+@app.after_request
+def record_latency(response):
+    started = g.get('request_started')
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, elapsed)
+        with metrics_lock:
+            histogram = route_latency.get(route)
+            if histogram is None:
+                # [per-bucket counts (+Inf last), sum, count]
+                histogram = route_latency[route] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+            histogram[0][bucket] += 1
+            histogram[1] += elapsed
+            histogram[2] += 1
+    return response
+
+def is_forwarded():
+    """Whether the current request was relayed here by another cluster node"""
+    return (bool(ADMIN_TOKEN) and request.headers.get(FORWARDED_HEADER) == '1'
+            and request.headers.get('X-Admin-Token') == ADMIN_TOKEN)
+
+def node_client(node):
+    client = node_clients.get(node)
+    if client is None:
+        with node_clients_lock:
+            client = node_clients.setdefault(node, NodeClient(node, timeout=MAX_POLL_WAIT + 15))
+    return client
+
+def node_request(node, method, path, body=None):
+    """Call another node as a forwarded request; `body` is JSON-encoded.
+    Returns (status, headers, body bytes)."""
+    headers = {FORWARDED_HEADER: '1', 'X-Admin-Token': ADMIN_TOKEN}
+    if body is not None:
+        headers['Content-Type'] = 'application/json'
+        body = json.dumps(body)
+    return node_client(node).request(method, path, body, headers)
+
+def relay(result):
+    """Turn a node_request() result into a response for our client"""
+    status, headers, body = result
+    response = app.response_class(body, status=status, mimetype=headers.get('Content-Type'))
+    if 'Retry-After' in headers:
+        response.headers['Retry-After'] = headers['Retry-After']
+    return response
+
+def forward(node, body=None):
+    """Relay the current request (or `body` instead of its own) to `node`"""
+    try:
+        return relay(node_request(node, request.method, request.full_path,
+                                  request.get_json(silent=True) if body is None else body))
+    except OSError as e:
+        return jsonify({'error': f'Node {node} unavailable: {e}'}), 502
+
+def forward_stream(node):
+    """Relay the current /stream from `node` as its events arrive"""
+    headers = {FORWARDED_HEADER: '1', 'X-Admin-Token': ADMIN_TOKEN}
+    try:
+        status, response_headers, chunks = node_client(node).stream('GET', request.full_path, headers)
+    except OSError as e:
+        return jsonify({'error': f'Node {node} unavailable: {e}'}), 502
+    if status != 200:
+        body = b''.join(chunks)
+        return app.response_class(body, status=status, mimetype=response_headers.get('Content-Type'))
+    
+    def events():
+        try:
+            for chunk in chunks:
+                yield chunk
+                # The owner only sends keepalives every STREAM_KEEPALIVE
+                if shutting_down:
+                    yield 'event: reconnect\ndata: {"reason": "shutdown"}\n\n'
+                    return
+        except OSError:
+            yield 'event: reconnect\ndata: {"reason": "node unavailable"}\n\n'
+        finally:
+            chunks.close()
+    
+    return app.response_class(events(), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def forward_many(requests_by_node, path):
+    """POST each node its body at once; yields results as they complete"""
+    futures = {cluster_pool.submit(node_request, node, 'POST', path, body): node
+               for node, body in requests_by_node.items()}
+    pending = set(futures)
+    while pending:
+        done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+def forward_batch():
+    """Split a /send/batch across the owners of its rooms"""
+    data = request.get_json(silent=True)
+    if isinstance(data, list):
+        data = {'messages': data}
+    items = data.get('messages') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items or len(items) > MAX_BATCH_SIZE:
+        return None  # let the local handler report the error
+    default_room = data.get('room', 'main')
+    
+    by_node = {}
+    for item in items:
+        # Check every text up front so no node stores part of a bad batch
+        if not isinstance(item, dict) or not (item.get('text') or '').strip():
+            return None
+        room = item.get('room', default_room)
+        by_node.setdefault(cluster_ring.owner(room), []).append(dict(item, room=room))
+    if list(by_node) == [NODE_URL]:
+        return None
+    
+    sent = 0
+    ids = {}
+    try:
+        for status, headers, body in forward_many(
+                {node: dict(data, messages=node_items) for node, node_items in by_node.items()},
+                '/send/batch'):
+            if status != 200:
+                return relay((status, headers, body))
+            reply = json.loads(body)
+            sent += reply['sent']
+            ids.update(reply['ids'])
+    except OSError as e:
+        return jsonify({'error': f'Node unavailable: {e}'}), 502
+    return jsonify({'success': True, 'sent': sent, 'ids': ids})
+
+def sub_poll(node, body, wait, stop):
+    """Long-poll one node in CLUSTER_POLL_SLICE steps until it has news,
+    `wait` runs out or `stop` is set. Returns (status, headers, body)."""
+    deadline = time.monotonic() + wait
+    while True:
+        remaining = max(deadline - time.monotonic(), 0)
+        result = node_request(node, 'POST', '/poll', dict(body, wait=min(remaining, CLUSTER_POLL_SLICE)))
+        if result[0] != 200 or remaining <= CLUSTER_POLL_SLICE or stop.is_set():
+            return result
+        reply = json.loads(result[2])
+        if reply.get('rooms') or reply.get('presence'):
+            return result
+
+def forward_poll():
+    """Split a /poll across the owners of its rooms and merge the replies.
+
+    Sub-polls wait in parallel; the first one with news ends the poll,
+    and the nodes still waiting are asked once more without waiting so
+    their news isn't left behind.
+    """
+    data = request.get_json(silent=True) or {}
+    cursors = data.get('cursors')
+    if not isinstance(cursors, dict) or not cursors or len(cursors) > MAX_POLL_ROOMS:
+        return None
+    
+    by_node = {}
+    for room, since in cursors.items():
+        by_node.setdefault(cluster_ring.owner(room), {})[room] = since
+    if list(by_node) == [NODE_URL]:
+        return None
+    if len(by_node) == 1:
+        return forward(next(iter(by_node)))
+    
+    typing = data.get('typing') if isinstance(data.get('typing'), list) else []
+    known_presence = data.get('presence') if isinstance(data.get('presence'), dict) else None
+    bodies = {}
+    for node, node_cursors in by_node.items():
+        body = dict(data, cursors=node_cursors, typing=[room for room in typing if room in node_cursors])
+        if known_presence is not None:
+            body['presence'] = {room: known_presence.get(room) for room in node_cursors}
+        bodies[node] = body
+    
+    wait = min(max(float(data.get('wait') or 0), 0), MAX_POLL_WAIT)
+    stop = threading.Event()
+    futures = {cluster_pool.submit(sub_poll, node, body, wait, stop): node for node, body in bodies.items()}
+    pending = set(futures)
+    updates = {}
+    presence = {}
+    try:
+        while pending and not (updates or presence):
+            done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                status, headers, body = future.result()
+                if status != 200:
+                    return relay((status, headers, body))
+                reply = json.loads(body)
+                updates.update(reply.get('rooms', {}))
+                presence.update(reply.get('presence', {}))
+        stop.set()
+        if pending:
+            for status, headers, body in forward_many(
+                    {futures[future]: dict(bodies[futures[future]], wait=0) for future in pending}, '/poll'):
+                if status != 200:
+                    return relay((status, headers, body))
+                reply = json.loads(body)
+                updates.update(reply.get('rooms', {}))
+                presence.update(reply.get('presence', {}))
+    except OSError as e:
+        return jsonify({'error': f'Node unavailable: {e}'}), 502
+    finally:
+        stop.set()
+    
+    if known_presence is not None:
+        return jsonify({'rooms': updates, 'presence': presence})
+    return jsonify({'rooms': updates})
+
+def gather_unread():
+    """Unread counts come from every node, since each holds its rooms' receipts"""
+    counts = {}
+    try:
+        for node in cluster_ring.nodes:
+            if node == NODE_URL:
+                counts.update(unread_counts(request.args.get('user')))
+                continue
+            status, headers, body = node_request(node, 'GET', request.full_path)
+            if status != 200:
+                return relay((status, headers, body))
+            counts.update(json.loads(body))
+    except OSError as e:
+        return jsonify({'error': f'Node unavailable: {e}'}), 502
+    return jsonify(counts)
+
+@app.before_request
+def route_to_owner():
+    """In cluster mode, hand room requests to the node that owns the room"""
+    if cluster_ring is None or is_forwarded():
+        return None
+    endpoint = request.endpoint
+    if endpoint in ('send_message', 'edit_message', 'delete_message', 'react'):
+        data = request.get_json(silent=True)
+        room = data.get('room', 'main') if isinstance(data, dict) else None
+    elif endpoint in ('get_messages', 'seen', 'search', 'stream'):
+        room = request.args.get('room', 'main')
+    elif endpoint == 'retention':
+        if request.method == 'GET':
+            room = request.args.get('room', 'main')
+        else:
+            # The owner trusts forwarded requests, so check the caller here
+            require_admin()
+            data = request.get_json(silent=True)
+            room = data.get('room', 'main') if isinstance(data, dict) else None
+    elif endpoint == 'send_batch':
+        return forward_batch()
+    elif endpoint == 'poll':
+        return forward_poll()
+    elif endpoint == 'unread' and request.args.get('user'):
+        return gather_unread()
+    else:
+        return None
+    
+    owner = cluster_ring.owner(room) if room is not None else NODE_URL
+    if owner == NODE_URL:
+        return None
+    if endpoint == 'stream':
+        return forward_stream(owner)
+    return forward(owner)
+
+def share_profile(user_id, profile):
+    """Copy a profile change to the other nodes, so messages look the same
+    whichever node stores them"""
+    body = dict(profile, user_id=user_id)
+    for node in cluster_ring.nodes:
+        if node == NODE_URL:
+            continue
+        with profile_shares_lock:
+            outbox = profile_shares.get(node)
+            if outbox is None:
+                outbox = profile_shares[node] = queue.Queue(MAX_PROFILE_SHARES)
+                threading.Thread(target=send_profiles, args=(node, outbox), daemon=True).start()
+        try:
+            outbox.put_nowait(body)
+        except queue.Full:
+            app.logger.warning('Profile queue for %s is full, dropping %s', node, user_id)
+
+def send_profiles(node, outbox):
+    """Deliver queued profile changes to `node`, in order"""
+    while True:
+        body = outbox.get()
+        try:
+            node_request(node, 'POST', '/user', body)
+        except OSError as e:
+            app.logger.warning('Could not share profile with %s: %s', node, e)
+
+def export_room(room):
+    """Every message still held for `room`, oldest first: its search
+    history plus the live window. Call with the room lock held."""
+    by_seq = {message['seq']: message for message in search_pending.get(room, ())}
+    by_seq.update(search_docs.get(room, {}))
+    for message in messages.get(room, []):
+        by_seq[message['seq']] = message
+    return [by_seq[seq] for seq in sorted(by_seq)]
+
+def drop_room(room):
+    """Forget a room's messages and indexes. Call with the room lock held."""
+    messages.pop(room, None)
+    message_seqs.pop(room, None)
+    room_seqs.pop(room, None)
+    room_counts.pop(room, None)
+    room_posted.pop(room, None)
+    room_bytes.pop(room, None)
+    room_views.pop(room, None)
+    search_index.pop(room, None)
+    search_impacts.pop(room, None)
+    search_docs.pop(room, None)
+    search_floor.pop(room, None)
+    search_pending.pop(room, None)
+    message_reactors.pop(room, None)
+    with activity_lock:
+        room_activity.pop(room, None)
+        room_ranks['messages'].discard(room)
+
+def import_room(room, imported, reactors=None):
+    """Take over a room (and who reacted to its messages) from another
+    node, merging with anything already posted here since the room moved.
+    Imported messages keep their seqs; later ones are renumbered after
+    them. Message ids (the cursors clients hold) don't change."""
+    with get_room_lock(room):
+        reactors = {**(reactors or {}), **message_reactors.get(room, {})}
+        combined = imported + export_room(room)
+        seen = set()
+        merged = []
+        for message in sorted(combined, key=lambda message: message['ts']):
+            if message['id'] not in seen:
+                seen.add(message['id'])
+                merged.append(message)
+        drop_room(room)
+        
+        seq = 0
+        for message in merged:
+            seq = max(seq + 1, message['seq'])
+            message['seq'] = seq
+        live = live_window(room, merged)
+        messages[room] = live
+        message_seqs[room] = cursor_seqs(live)
+        room_seqs[room] = seq
+        room_counts[room] = sum(1 for message in live if not message.get('type'))
+        room_posted[room] = sum(1 for message in merged if not message.get('type'))
+        room_bytes[room] = sum(message_size(message) for message in live)
+        reactors = {message_id: dict(users) for message_id, users in reactors.items()
+                    if message_id in message_seqs[room]}
+        if reactors:
+            message_reactors[room] = reactors
+        if merged:
+            search_floor[room] = merged[0]['seq']
+        index_messages(room, merged)
+        record_change({'type': 'import', 'room': room, 'messages': imported,
+                       'reactors': {message_id: dict(users) for message_id, users in reactors.items()}})
+    
+    if merged:
+        with activity_lock:
+            room_activity[room] = merged[-1]['ts']
+            room_ranks['messages'].set(room, room_counts[room])
+        max_age = retention_policy(room)['max_age']
+        if max_age:
+            schedule_expiry(room, live[0]['ts'], max_age)
+    notify_room(room)
+    return len(merged)
+
+def migrate_rooms():
+    """Hand every room this node no longer owns to its owner. The room
+    stays locked until the owner has it, so no send lands in between.
+    Returns False if some node couldn't be reached."""
+    ok = True
+    for room in list(messages):
+        owner = cluster_ring.owner(room)
+        if owner == NODE_URL:
+            continue
+        with get_room_lock(room):
+            try:
+                status, _, body = node_request(owner, 'POST', '/cluster/import',
+                                               {'room': room, 'messages': export_room(room),
+                                                'reactors': message_reactors.get(room, {}),
+                                                'retention': room_retention.get(room, {})})
+            except OSError as e:
+                status, body = None, str(e)
+            if status != 200:
+                app.logger.warning('Could not move room %s to %s: %s %s', room, owner, status, body)
+                ok = False
+                continue
+            drop_room(room)
+            room_retention.pop(room, None)
+        notify_room(room)
+    return ok
+
+def rebalance_loop():
+    while True:
+        rebalance_requested.wait()
+        rebalance_requested.clear()
+        while not migrate_rooms():
+            time.sleep(1)
+        # A send routed here just before the ring changed may still land
+        time.sleep(2)
+        migrate_rooms()
+
+@app.route('/cluster/nodes', methods=['GET', 'POST'])
+def cluster_nodes():
+    """Cluster membership. POST {"nodes": [urls]} to add or remove nodes;
+    the change is passed on to every old and new node and rooms move to
+    their new owners in the background."""
+    global cluster_ring, rebalancer
+    require_admin()
+    if cluster_ring is None:
+        return jsonify({'error': 'Not running in cluster mode'}), 400
+    if request.method == 'GET':
+        return jsonify({'node': NODE_URL, 'nodes': cluster_ring.nodes})
+    
+    nodes = (request.get_json(silent=True) or {}).get('nodes')
+    if not isinstance(nodes, list) or not nodes or not all(isinstance(node, str) for node in nodes):
+        return jsonify({'error': 'No nodes'}), 400
+    nodes = [node.rstrip('/') for node in nodes]
+    
+    previous = cluster_ring.nodes
+    cluster_ring = HashRing(nodes)
+    unreachable = []
+    if not is_forwarded():
+        for node in sorted(set(previous) | set(nodes)):
+            if node == NODE_URL:
+                continue
+            try:
+                status, _, _ = node_request(node, 'POST', '/cluster/nodes', {'nodes': nodes})
+            except OSError:
+                status = None
+            if status != 200:
+                unreachable.append(node)
+    
+    if rebalancer is None:
+        rebalancer = threading.Thread(target=rebalance_loop, daemon=True)
+        rebalancer.start()
+    rebalance_requested.set()
+    return jsonify({'success': True, 'nodes': cluster_ring.nodes, 'unreachable': unreachable})
+
+@app.route('/cluster/import', methods=['POST'])
+def cluster_import():
+    """Receive a room from another node during rebalancing"""
+    require_admin()
+    data = request.get_json(silent=True) or {}
+    room = data.get('room')
+    imported = data.get('messages')
+    if not room or not isinstance(imported, list):
+        return jsonify({'error': 'No room or messages'}), 400
+    if isinstance(data.get('retention'), dict):
+        set_retention(room, data['retention'])
+    return jsonify({'success': True, 'messages': import_room(room, imported, data.get('reactors'))})
+
+@app.before_request
+def reject_writes_on_replica():
+    """Replicas are read-only until promoted"""
+    if replica_of is not None and request.endpoint in WRITE_ENDPOINTS and request.method == 'POST':
+        return jsonify({'error': 'Read-only replica', 'primary': replica_of}), 503
+    return None
+
+@app.route('/replication/stream')
+def replication_stream():
+    """Changes after ?after=<offset>, waiting up to ?wait= seconds for one.
+    Replies {"reset": true} when the log no longer reaches back that far."""
+    require_admin()
+    try:
+        after = int(request.args.get('after', 0))
+        wait = min(max(float(request.args.get('wait', 0)), 0), MAX_POLL_WAIT)
+    except ValueError:
+        return jsonify({'error': 'Invalid after or wait'}), 400
+    
+    deadline = time.monotonic() + wait
+    with replication_changed:
+        while replication_head <= after and not shutting_down:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            replication_changed.wait(remaining)
+        head = replication_head
+        floor = replication_log[0][0] if replication_log else head + 1
+        if after > head or (head > after and floor > after + 1):
+            return jsonify({'reset': True, 'head': head})
+        start = max(after + 1 - floor, 0)
+        entries = list(itertools.islice(replication_log, start, start + MAX_REPLICATION_BATCH))
+    return jsonify({'entries': entries, 'head': head})
+
+@app.route('/replication/snapshot')
+def replication_snapshot():
+    """Every room and profile, plus the log offset the copy starts from.
+    Changes racing the copy may be in it and in the log; replaying them is
+    harmless."""
+    require_admin()
+    with replication_changed:
+        offset = replication_head
+    rooms = {}
+    reactors = {}
+    for room in list(messages):
+        with get_room_lock(room):
+            rooms[room] = export_room(room)
+            reactors[room] = message_reactors.get(room, {})
+    return jsonify({'offset': offset, 'users': dict(user_info), 'rooms': rooms,
+                    'retention': dict(room_retention), 'reactors': reactors})
+
+@app.route('/replication', methods=['GET'])
+def replication_status():
+    require_admin()
+    return jsonify({
+        'role': 'replica' if replica_of else 'primary',
+        'primary': replica_of,
+        'head': replication_head,
+        'offset': replica_state['offset'] if replica_of else None,
+        'lag_seconds': replication_lag() if replica_of else None,
+    })
+
+@app.route('/replication/promote', methods=['POST'])
+def replication_promote():
+    """Stop following the primary and start taking writes"""
+    global replica_of
+    require_admin()
+    if replica_of is None:
+        return jsonify({'error': 'Not a replica'}), 400
+    replica_of = None
+    app.logger.warning('Promoted to primary at offset %s', replica_state['offset'])
+    return jsonify({'success': True, 'offset': replica_state['offset']})
+
+def replication_lag():
+    """Seconds since this replica last had everything the primary had"""
+    if replica_state['waiting'] and replica_state['offset'] >= replica_state['head']:
+        return 0.0
+    if replica_state['caught_up_at'] is None:
+        return None
+    return time.time() - replica_state['caught_up_at']
+
+def load_primary_snapshot(primary):
+    status, _, body = node_request(primary, 'GET', '/replication/snapshot')
+    if status != 200:
+        raise OSError(f'snapshot failed with status {status}')
+    snapshot = json.loads(body)
+    for user_id, profile in snapshot['users'].items():
+        apply_change({'type': 'profile', 'user_id': user_id, 'profile': profile})
+    for room, policy in snapshot.get('retention', {}).items():
+        apply_change({'type': 'retention', 'room': room, 'policy': policy})
+    reactors = snapshot.get('reactors', {})
+    for room, room_messages in snapshot['rooms'].items():
+        import_room(room, room_messages, reactors.get(room))
+    return snapshot['offset']
+
+def follow_primary():
+    """Tail the primary's change log until promoted"""
+    offset = None
+    while replica_of is not None:
+        primary = replica_of
+        try:
+            if offset is None:
+                offset = load_primary_snapshot(primary)
+                replica_state['offset'] = offset
+            replica_state['waiting'] = True
+            status, _, body = node_request(primary, 'GET', f'/replication/stream?after={offset}&wait={MAX_POLL_WAIT}')
+            replica_state['waiting'] = False
+            if status != 200:
+                raise OSError(f'stream failed with status {status}')
+            reply = json.loads(body)
+            if replica_of is None:
+                break
+            if reply.get('reset'):
+                offset = None
+                continue
+            for entry_offset, entry in reply['entries']:
+                try:
+                    apply_change(entry, replayed=True)
+                except ValueError as e:
+                    # Out of step with the primary: start over from a snapshot
+                    app.logger.warning('Replica diverged from %s: %s', primary, e)
+                    offset = None
+                    break
+                offset = entry_offset
+            if offset is None:
+                continue
+            replica_state['offset'] = offset
+            replica_state['head'] = reply['head']
+            if offset >= reply['head']:
+                replica_state['caught_up_at'] = time.time()
+        except (OSError, ValueError, KeyError) as e:
+            replica_state['waiting'] = False
+            app.logger.warning('Replication from %s failed: %s', primary, e)
+            time.sleep(1)
+
+def snapshot_state(locked=True):
+    """Everything a restart needs, as plain marshal-able values. `locked`
+    copies each room under its lock; a forked child must not take locks."""
+    rooms = []
+    reactors = {}
+    for room in list(messages):
+        with get_room_lock(room) if locked else nullcontext():
+            rooms.append((room, room_seqs.get(room, 0), room_bytes.get(room, 0), export_room(room)))
+            if room in message_reactors:
+                reactors[room] = message_reactors[room]
+    return {'created': time.time(), 'users': dict(user_info), 'rooms': rooms,
+            'retention': dict(room_retention), 'reactors': reactors}
+
+def dump_snapshot(path, locked=True):
+    """Write the state to `path` via a temporary file, so a crash mid-write
+    leaves the previous snapshot in place"""
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        marshal.dump(snapshot_state(locked), f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def write_snapshot(path=None, fork=True):
+    """Snapshot the state unless nothing changed since the last one.
+
+    With `fork` (and where the OS has it) a child process serializes its
+    copy-on-write view of memory while this process carries on.
+    """
+    path = path or SNAPSHOT_PATH
+    with snapshot_lock:
+        head = replication_head
+        if head == snapshot_stats['head']:
+            return False
+        started = time.monotonic()
+        if fork and hasattr(os, 'fork'):
+            pid = os.fork()
+            if pid == 0:
+                code = 1
+                try:
+                    dump_snapshot(path, locked=False)
+                    code = 0
+                finally:
+                    os._exit(code)
+            _, status = os.waitpid(pid, 0)
+            if status != 0:
+                raise OSError(f'snapshot process failed with status {status}')
+        else:
+            dump_snapshot(path)
+        snapshot_stats.update(head=head, written_at=time.time(),
+                              seconds=time.monotonic() - started, bytes=os.path.getsize(path))
+    return True
+
+def snapshot_loop():
+    while True:
+        time.sleep(SNAPSHOT_SECONDS)
+        try:
+            write_snapshot()
+        except Exception:
+            app.logger.exception('Snapshot failed')
+
+def load_snapshot(path):
+    """Restore the state saved by write_snapshot(). Rooms are rebuilt
+    straight from the mapped file; their search indexes wait until needed."""
+    global profile_version
+    started = time.monotonic()
+    # Nothing loaded here has cycles; skip the collector passes that
+    # allocating millions of objects would trigger
+    gc.disable()
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if mapped[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                raise ValueError(f'{path} is not a message board snapshot')
+            with memoryview(mapped) as view:
+                data = view[len(SNAPSHOT_MAGIC):]
+                try:
+                    state = marshal.loads(data)
+                finally:
+                    data.release()
+        
+        user_info.update(state['users'])
+        room_retention.update(state.get('retention', {}))
+        message_reactors.update(state.get('reactors', {}))
+        profile_version += 1
+        activity = []
+        for room, seq, _, room_messages in state['rooms']:
+            live = live_window(room, room_messages)
+            messages[room] = live
+            message_seqs[room] = cursor_seqs(live)
+            room_seqs[room] = seq
+            room_counts[room] = sum(1 for message in live if not message.get('type'))
+            room_posted[room] = sum(1 for message in room_messages if not message.get('type'))
+            room_bytes[room] = sum(message_size(message) for message in live)
+            if room_messages:
+                search_pending[room] = room_messages
+                activity.append((live[-1]['ts'], room))
+        activity.sort()
+        with activity_lock:
+            for ts, room in activity:
+                room_activity[room] = ts
+                room_ranks['messages'].set(room, room_counts[room])
+        for room, room_messages in search_pending.items():
+            max_age = retention_policy(room)['max_age']
+            if max_age:
+                schedule_expiry(room, messages[room][0]['ts'], max_age)
+    finally:
+        gc.enable()
+    snapshot_stats['load_seconds'] = time.monotonic() - started
+    return len(state['rooms'])
+
+def bus_publish(channel, payload):
+    """Publish a JSON payload on the bus, tagged with this node's id"""
+    if bus is None:
+        return
+    if bus.publish(channel, json.dumps(dict(payload, origin=NODE_ID)).encode()) is False:
+        return
+    with metrics_lock:
+        bus_messages['out'] += 1
+
+def watch_room(room):
+    """Subscribe to a room's channel while local clients read it. A new
+    subscription asks the nodes already watching for the room's messages."""
+    if bus is None:
+        return
+    with bus_lock:
+        is_new = room not in bus_rooms
+        bus_rooms[room] = time.monotonic()
+    if is_new:
+        bus.subscribe('room:' + room)
+        bus_publish('room:' + room, {'type': 'sync'})
+
+def on_bus_message(channel, payload):
+    """Apply what other nodes published: appends, profiles, and room
+    snapshots sent in answer to our sync requests"""
+    try:
+        data = json.loads(payload)
+        if data.get('origin') == NODE_ID:
+            return
+        with metrics_lock:
+            bus_messages['in'] += 1
+        kind = data.get('type')
+        if kind == 'profile':
+            apply_change(data)
+            return
+        if not channel.startswith('room:'):
+            return
+        room = channel[len('room:'):]
+        if kind == 'append':
+            apply_change(dict(data, room=room))
+        elif kind == 'sync':
+            with get_room_lock(room):
+                live = list(messages.get(room, []))
+            if live:
+                bus_publish(channel, {'type': 'snapshot', 'to': data['origin'], 'messages': live})
+        elif kind == 'snapshot' and data.get('to') == NODE_ID:
+            import_room(room, data['messages'])
+    except Exception:
+        app.logger.exception('Bad bus message on %s', channel)
+
+def sweep_bus_rooms():
+    """Unsubscribe from rooms no local client has read for a while"""
+    while True:
+        time.sleep(BUS_IDLE_SECONDS / 2)
+        cutoff = time.monotonic() - BUS_IDLE_SECONDS
+        with bus_lock:
+            idle = [room for room, last_read in bus_rooms.items() if last_read < cutoff]
+            for room in idle:
+                del bus_rooms[room]
+        for room in idle:
+            bus.unsubscribe('room:' + room)
+
+def emit_trace(response):
+    """Report the request's phases as Server-Timing and to the trace log"""
+    global trace_log_file
+    phases = g.get('phases')
+    if phases is None:
+        return response
+    total = time.perf_counter() - g.request_started
+    
+    timing = [f'{name};dur={elapsed * 1000:.3f}' for name, elapsed in phases]
+    timing.append(f'total;dur={total * 1000:.3f}')
+    response.headers['Server-Timing'] = ', '.join(timing)
+    
+    if TRACE_LOG:
+        line = json.dumps({
+            'timestamp': datetime.now().isoformat(),
+            'method': request.method,
+            'route': request.url_rule.rule if request.url_rule else None,
+            'status': response.status_code,
+            'phases_ms': {name: round(elapsed * 1000, 3) for name, elapsed in phases},
+            'total_ms': round(total * 1000, 3),
+        })
+        with trace_log_lock:
+            if trace_log_file is None:
+                trace_log_file = open(TRACE_LOG, 'a', buffering=1)
+            trace_log_file.write(line + '\n')
+    return response
+
+# Only hook tracing in when it's switched on
+if TRACING:
+    app.after_request(emit_trace)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text-format metrics"""
+    with metrics_lock:
+        latency = {route: ([*h[0]], h[1], h[2]) for route, h in route_latency.items()}
+        polls = dict(poll_results)
+        sent = messages_total
+    
+    sizes = dict(room_bytes)
+    stored = sum(len(room_messages) for room_messages in list(messages.values()))
+    
+    lines = [
+        '# HELP message_board_request_duration_seconds Request latency by route',
+        '# TYPE message_board_request_duration_seconds histogram',
+    ]
+    for route, (buckets, total, count) in sorted(latency.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+            cumulative += bucket_count
+            lines.append(f'message_board_request_duration_seconds_bucket{{route="{route}",le="{bound}"}} {cumulative}')
+        lines.append(f'message_board_request_duration_seconds_sum{{route="{route}"}} {total:.6f}')
+        lines.append(f'message_board_request_duration_seconds_count{{route="{route}"}} {count}')
+    
+    lines += [
+        '# HELP message_board_rooms Rooms holding messages',
+        '# TYPE message_board_rooms gauge',
+        f'message_board_rooms {len(messages)}',
+        '# HELP message_board_stored_messages Messages currently stored across all rooms',
+        '# TYPE message_board_stored_messages gauge',
+        f'message_board_stored_messages {stored}',
+        '# HELP message_board_messages_total Messages posted since start',
+        '# TYPE message_board_messages_total counter',
+        f'message_board_messages_total {sent}',
+        '# HELP message_board_users Entries in user_info',
+        '# TYPE message_board_users gauge',
+        f'message_board_users {len(user_info)}',
+        '# HELP message_board_polls_total Message reads by outcome (hit = non-empty)',
+        '# TYPE message_board_polls_total counter',
+        f'message_board_polls_total{{result="hit"}} {polls["hit"]}',
+        f'message_board_polls_total{{result="miss"}} {polls["miss"]}',
+        '# HELP message_board_room_memory_bytes Approximate memory held by room messages',
+        '# TYPE message_board_room_memory_bytes gauge',
+        f'message_board_room_memory_bytes{{stat="total"}} {sum(sizes.values())}',
+        f'message_board_room_memory_bytes{{stat="avg"}} {sum(sizes.values()) // max(len(sizes), 1)}',
+        f'message_board_room_memory_bytes{{stat="max"}} {max(sizes.values(), default=0)}',
+    ]
+    lines += [
+        '# HELP message_board_replication_head Changes recorded in this node\'s replication log',
+        '# TYPE message_board_replication_head counter',
+        f'message_board_replication_head {replication_head}',
+    ]
+    if replica_of is not None:
+        lag = replication_lag()
+        lines += [
+            '# HELP message_board_replication_lag_entries Primary changes not applied here yet',
+            '# TYPE message_board_replication_lag_entries gauge',
+            f'message_board_replication_lag_entries {max(replica_state["head"] - replica_state["offset"], 0)}',
+            '# HELP message_board_replication_lag_seconds Seconds since this replica was last caught up',
+            '# TYPE message_board_replication_lag_seconds gauge',
+            f'message_board_replication_lag_seconds {-1 if lag is None else round(lag, 3)}',
+        ]
+    with stream_lock:
+        subscribers = [subscriber for room_subscribers in stream_subscribers.values()
+                       for subscriber in room_subscribers]
+    depths = [len(subscriber.batches) for subscriber in subscribers]
+    overflows = dict(stream_overflows)
+    lines += [
+        '# HELP message_board_stream_subscribers Open /stream connections',
+        '# TYPE message_board_stream_subscribers gauge',
+        f'message_board_stream_subscribers {len(subscribers)}',
+        '# HELP message_board_stream_queue_depth Batches waiting in /stream queues',
+        '# TYPE message_board_stream_queue_depth gauge',
+        f'message_board_stream_queue_depth{{stat="total"}} {sum(depths)}',
+        f'message_board_stream_queue_depth{{stat="max"}} {max(depths, default=0)}',
+        '# HELP message_board_stream_overflows_total Full /stream queues by policy applied',
+        '# TYPE message_board_stream_overflows_total counter',
+    ]
+    lines += [f'message_board_stream_overflows_total{{policy="{policy}"}} {overflows.get(policy, 0)}'
+              for policy in STREAM_POLICIES]
+    if SNAPSHOT_PATH:
+        stats = dict(snapshot_stats)
+        lines += [
+            '# HELP message_board_snapshot_written_timestamp_seconds When the last snapshot was written',
+            '# TYPE message_board_snapshot_written_timestamp_seconds gauge',
+            f'message_board_snapshot_written_timestamp_seconds {stats["written_at"] or 0:.3f}',
+            '# HELP message_board_snapshot_duration_seconds Time the last snapshot took to write',
+            '# TYPE message_board_snapshot_duration_seconds gauge',
+            f'message_board_snapshot_duration_seconds {stats["seconds"] or 0:.6f}',
+            '# HELP message_board_snapshot_bytes Size of the last snapshot',
+            '# TYPE message_board_snapshot_bytes gauge',
+            f'message_board_snapshot_bytes {stats["bytes"] or 0}',
+            '# HELP message_board_snapshot_load_seconds Time taken to load the snapshot at startup',
+            '# TYPE message_board_snapshot_load_seconds gauge',
+            f'message_board_snapshot_load_seconds {stats["load_seconds"] or 0:.6f}',
+        ]
+    if bus is not None:
+        lines += [
+            '# HELP message_board_bus_messages_total Pub/sub messages by direction',
+            '# TYPE message_board_bus_messages_total counter',
+            f'message_board_bus_messages_total{{direction="out"}} {bus_messages["out"]}',
+            f'message_board_bus_messages_total{{direction="in"}} {bus_messages["in"]}',
+            '# HELP message_board_bus_dropped_total Pub/sub messages dropped (publish queue full or bus unreachable)',
+            '# TYPE message_board_bus_dropped_total counter',
+            f'message_board_bus_dropped_total {bus.dropped}',
+            '# HELP message_board_bus_rooms Rooms this node is subscribed to',
+            '# TYPE message_board_bus_rooms gauge',
+            f'message_board_bus_rooms {len(bus_rooms)}',
+        ]
+    return app.response_class('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+def require_admin():
+    """404 unless admin tools are enabled and the request carries the token"""
+    if not ADMIN_TOKEN or request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        abort(404)
+
+def sample_stacks(seconds, interval):
+    """Sample every other thread's stack for `seconds` and return the stacks
+    in collapsed (flamegraph.pl / speedscope) format"""
+    me = threading.get_ident()
+    samples = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            samples[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    return ''.join(f'{stack} {count}\n' for stack, count in samples.most_common())
+
+@app.route('/admin/profile')
+def admin_profile():
+    """Profile the live process for ?seconds=N and return collapsed stacks"""
+    require_admin()
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', 0.005))
+    except ValueError:
+        return jsonify({'error': 'Invalid seconds or interval'}), 400
+    if not (math.isfinite(seconds) and math.isfinite(interval)):
+        return jsonify({'error': 'Invalid seconds or interval'}), 400
+    seconds = min(seconds, MAX_PROFILE_SECONDS)
+    interval = max(interval, 0.001)
+    
+    if not profiler_lock.acquire(blocking=False):
+        return jsonify({'error': 'Profiler already running'}), 409
+    try:
+        collapsed = sample_stacks(seconds, interval)
+    finally:
+        profiler_lock.release()
+    
+    return app.response_class(collapsed, mimetype='text/plain')
+
+@app.route('/admin/slowlog')
+def admin_slowlog():
+    """Most recent requests over MESSAGE_BOARD_SLOW_MS, newest first"""
+    require_admin()
+    return jsonify(list(reversed(slow_requests)))
+
+def record_slow_request(response):
+    elapsed_ms = (time.perf_counter() - g.get('request_started', time.perf_counter())) * 1000
+    if elapsed_ms >= SLOW_REQUEST_MS:
+        entry = {
+            'timestamp': datetime.now().isoformat(),
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': response.status_code,
+            'ms': round(elapsed_ms, 2),
+        }
+        slow_requests.append(entry)
+        app.logger.warning('Slow request: %(method)s %(path)s %(status)s %(ms)sms', entry)
+    return response
+
+# Only hook the slow log in when it's switched on
+if SLOW_REQUEST_MS > 0:
+    app.after_request(record_slow_request)
+
+def profile_on_signal(signum, frame):
+    """SIGUSR2: profile for 10s in the background and write profile-<time>.folded"""
+    def run():
+        if not profiler_lock.acquire(blocking=False):
+            return
+        try:
+            collapsed = sample_stacks(10, 0.005)
+        finally:
+            profiler_lock.release()
+        path = f'profile-{datetime.now().strftime("%Y%m%d-%H%M%S")}.folded'
+        with open(path, 'w') as f:
+            f.write(collapsed)
+        print(f'Profile written to {path}')
+    threading.Thread(target=run, daemon=True).start()
+
+def print_banner(theme):
+    cosmic = theme == 'cosmic'
     print("\n" + "="*50)
-    print("🚀 FAST MESSAGE BOARD")
+    print("🚀 COSMIC MESSAGE BOARD" if cosmic else "🚀 FAST MESSAGE BOARD")
     print("="*50)
     print("\n📍 Local: http://localhost:5000")
+    print("   Other theme: http://localhost:5000/?theme=" + ('normal' if cosmic else 'cosmic'))
     print("\n🔗 To share with friends (using bore.pub):")
     print("   1. Install bore.pub")
     print("   2. In a NEW terminal, expose your port:")
@@ -1200,9 +2996,89 @@ if __name__ == '__main__':
     print("   3. bore.pub will give you a public URL like:")
     print("      https://bore.pub:12345")
     print("   4. Send that URL to anyone!")
-    print("\n🎨 Features:")
-    print("   • Choose avatar shape: Square, Circle, or Diamond")
-    print("   • Choose avatar color")
-    print("   • Change your name")
+    if cosmic:
+        print("\n🌌 Features:")
+        print("   • Blinking stars in deep black cosmic background")
+        print("   • Transparent glass-morphism UI elements")
+        print("   • Backdrop blur effects throughout")
+        print("\n🎨 Personalization:")
+        print("   • Choose avatar shape: Square, Circle, or Diamond")
+        print("   • 12 color choices")
+        print("   • Customizable display name")
+    else:
+        print("\n🎨 Features:")
+        print("   • Choose avatar shape: Square, Circle, or Diamond")
+        print("   • Choose avatar color")
+        print("   • Change your name")
     print("\n" + "="*50)
-    app.run(host='0.0.0.0', port=5000, debug=True)
+
+if SNAPSHOT_PATH:
+    if os.path.exists(SNAPSHOT_PATH):
+        print(f'Loaded {load_snapshot(SNAPSHOT_PATH)} rooms from {SNAPSHOT_PATH} '
+              f'in {snapshot_stats["load_seconds"]:.3f}s')
+    # Only write once something changes (this also keeps the debug
+    # reloader's idle parent process from overwriting the file)
+    snapshot_stats['head'] = replication_head
+    threading.Thread(target=snapshot_loop, daemon=True).start()
+
+if PUBSUB_URL:
+    bus = pubsub.connect(PUBSUB_URL, on_bus_message)
+    bus.subscribe('profiles')
+    threading.Thread(target=sweep_bus_rooms, daemon=True).start()
+
+if replica_of is not None:
+    threading.Thread(target=follow_primary, daemon=True).start()
+
+def graceful_shutdown():
+    """Let in-flight requests finish (long-polls are told to reconnect),
+    then flush the trace log and write a final snapshot"""
+    global shutting_down
+    deadline = time.monotonic() + SHUTDOWN_SECONDS
+    with inflight_changed:
+        shutting_down = True
+    for condition in (new_messages, replication_changed):
+        with condition:
+            condition.notify_all()
+    with stream_lock:
+        subscribers = [subscriber for room_subscribers in stream_subscribers.values()
+                       for subscriber in room_subscribers]
+    for subscriber in subscribers:
+        subscriber.close('shutdown')
+    
+    with inflight_changed:
+        while inflight_requests:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print(f'Shutdown deadline passed with {inflight_requests} requests still running')
+                break
+            inflight_changed.wait(remaining)
+    
+    with trace_log_lock:
+        if trace_log_file is not None:
+            trace_log_file.flush()
+            os.fsync(trace_log_file.fileno())
+    if SNAPSHOT_PATH:
+        write_snapshot(fork=False)
+        print(f'Final snapshot written to {SNAPSHOT_PATH}')
+
+def main():
+    print_banner(DEFAULT_THEME)
+    # SIGUSR2 writes a 10s profile of the running server
+    if hasattr(signal, 'SIGUSR2'):
+        signal.signal(signal.SIGUSR2, profile_on_signal)
+    
+    server = make_server('0.0.0.0', 5000, app, threaded=True)
+    
+    def stop(signum, frame):
+        # serve_forever() runs in this thread, so stop it from another one
+        print('\nShutting down...')
+        threading.Thread(target=server.shutdown, daemon=True).start()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    
+    # Returns once stop() has run; the listening socket is closed by then
+    server.serve_forever()
+    graceful_shutdown()
+
+if __name__ == '__main__':
+    main()
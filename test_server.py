@@ -0,0 +1,64 @@
+"""Regression tests for server.py: python -m pytest -q"""
+import threading
+import time
+
+import server
+
+
+def test_concurrent_sends_reach_streams_in_order(monkeypatch):
+    room = 'stream-order'
+    subscriber = server.Subscriber(room, 'resync')
+    server.stream_subscribers.setdefault(room, set()).add(subscriber)
+    
+    # Hold up the first send between storing its message and fanning it out
+    fan_out = server.fan_out
+    first = threading.Event()
+    
+    def slow_fan_out(room, new):
+        if not first.is_set():
+            first.set()
+            time.sleep(0.2)
+        fan_out(room, new)
+    
+    monkeypatch.setattr(server, 'fan_out', slow_fan_out)
+    
+    def send(text):
+        server.append_messages(room, [server.build_message(text, 'u1', server.get_user_info('u1'))])
+    
+    a = threading.Thread(target=send, args=('from A',))
+    a.start()
+    first.wait()
+    b = threading.Thread(target=send, args=('from B',))
+    b.start()
+    a.join()
+    b.join()
+    
+    delivered = []
+    kind, batch = subscriber.next(0)
+    while kind == 'batch':
+        delivered.extend(message['text'] for message in batch)
+        kind, batch = subscriber.next(0)
+    assert delivered == ['from A', 'from B']
+
+
+def test_reaction_entries_never_evict_messages():
+    room = 'entry-cap'
+    user = server.get_user_info('u1')
+    for index in range(200):
+        server.append_messages(room, [server.build_message(f'm{index}', 'u1', user)])
+    ids = [message['id'] for message in server.messages[room]]
+    for emoji in ('a', 'b', 'c'):
+        for message_id in ids:
+            server.append_messages(room, [server.build_entry('react', target=message_id, emoji=emoji,
+                                                             sender_id='u1', remove=False)])
+    
+    room_messages = server.messages[room]
+    assert server.room_counts[room] == 200
+    assert [message['id'] for message in room_messages if not message.get('type')] == ids
+    assert sum(1 for message in room_messages if message.get('type')) == server.MAX_ROOM_ENTRIES
+    assert server.room_bytes[room] == sum(server.message_size(message) for message in room_messages)
+    
+    # The newest entries are the ones kept
+    server.append_messages(room, [server.build_entry('react', target=ids[0], emoji='d',
+                                                     sender_id='u2', remove=False)])
+    assert server.messages[room][-1]['count'] == 1